@@ -0,0 +1,222 @@
+import argparse
+
+# Nothing heavy is imported at module level. Each subcommand imports what it
+# needs, so that numeric-only commands never pay for importing matplotlib.
+
+
+def run_times(args):
+    import analyse_times
+
+    analyse_times.main(density=args.density, bands=args.bands, impute=args.impute, output_path=args.output or 'rider_times.png', dpi=args.dpi, show=args.show, db_path=args.db)
+
+
+def run_fast_riders(args):
+    import analyse_fast_riders
+
+    analyse_fast_riders.main(output_path=args.output or 'rider_100hour_times.png', dpi=args.dpi, show=args.show, db_path=args.db)
+
+
+def run_finishes(args):
+    import analyse_finishes
+
+    analyse_finishes.main(output_path=args.output or 'finish_times.png', dpi=args.dpi, show=args.show, db_path=args.db)
+
+
+def run_my_times(args):
+    import analyse_my_times
+
+    analyse_my_times.main(output_path=args.output or 'my_times.png', dpi=args.dpi, show=args.show)
+
+
+def run_stats(args):
+    import numpy as np
+
+    from analyse_finishes import calculate_finish_times
+    from rider_data import CUT_OFF_HOURS, PATH_TO_DATA, load_rider_data
+
+    if args.db:
+        from rider_db import query_rider_data
+
+        rider_data, _ = query_rider_data(
+            args.db,
+            finished=args.finished,
+            start_location=args.start_location,
+            start_time=args.start_time,
+            reached=(args.reached[0], float(args.reached[1])) if args.reached else None,
+        )
+    else:
+        rider_data, _ = load_rider_data(args.data or PATH_TO_DATA)
+    finish_times = calculate_finish_times(rider_data)
+
+    n_100 = np.sum(finish_times < 100)
+    n_128 = np.sum(finish_times < CUT_OFF_HOURS) - n_100
+    n_dnf = len(finish_times) - n_100 - n_128
+
+    print(f'Number of riders: {len(rider_data)}')
+    print(f'Number of finishers: {len(finish_times)}')
+    print(f'{n_100} under 100 hours')
+    print(f'{n_128} between 100 and {CUT_OFF_HOURS} hours')
+    print(f'{n_dnf} after {CUT_OFF_HOURS} hours')
+
+
+def run_export(args):
+    from rider_db import PATH_TO_DATABASE, export_sqlite
+
+    print(f'Wrote {export_sqlite(args.output or PATH_TO_DATABASE, args.data)}')
+
+
+def run_validate(args):
+    import sys
+
+    from rider_data import load_rider_data
+    from rider_validation import anomaly_report, find_anomalies, write_report
+
+    rider_data, _ = load_rider_data(args.data)
+    report = anomaly_report(find_anomalies(rider_data, max_speed=args.max_speed))
+
+    print(f'Riders with anomalies: {len(report)} of {len(rider_data)}', file=sys.stderr)
+
+    if args.output:
+        with open(args.output, 'w', newline='') as f:
+            write_report(f, report)
+    else:
+        write_report(sys.stdout, report)
+
+
+def run_stops(args):
+    import sys
+
+    import numpy as np
+
+    from rider_data import load_rider_data
+    from rider_stops import find_stops, stop_table, write_table
+
+    rider_data, _ = load_rider_data(args.data)
+    stops = find_stops(rider_data, min_stop_hours=args.min_hours)
+
+    print(f'Riders with a stop: {np.sum(~np.isnan(stops).all(axis=1))} of {len(rider_data)}', file=sys.stderr)
+
+    if args.output:
+        with open(args.output, 'w', newline='') as f:
+            write_table(f, stop_table(stops))
+    else:
+        write_table(sys.stdout, stop_table(stops))
+
+
+def run_predict(args):
+    import csv
+    import sys
+
+    from predict_finish import last_controls, load_predictor, predict_finish
+    from rider_data import CONTROLS, PATH_TO_DATA, load_rider_data
+
+    model = load_predictor(args.history or PATH_TO_DATA)
+
+    rider_data, _ = load_rider_data(args.data)
+    predicted, std_error, risk = predict_finish(model, rider_data)
+    last = last_controls(rider_data)
+
+    writer = csv.writer(sys.stdout)
+    writer.writerow(['rider', 'last_control', 'predicted_finish_hours', 'std_error_hours', 'cut_off_risk'])
+    for r in range(len(rider_data)):
+        writer.writerow([
+            r,
+            CONTROLS[last[r]] if last[r] >= 0 else '',
+            f'{predicted[r]:.2f}',
+            f'{std_error[r]:.2f}',
+            f'{risk[r]:.2f}',
+        ])
+
+
+def run_follow(args):
+    from follow import follow
+
+    follow(args.path, args.interval)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Analyse the LEL 2022 rider data.')
+    parser.add_argument('--profile', metavar='PATH', help='Write a JSON report of the time and memory used by each stage.')
+    parser.add_argument('--trace', metavar='PATH', help='Write a Chrome trace of each stage.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    plots = [
+        ('times', run_times, 'Rider times relative to 128 hour pace.'),
+        ('fast-riders', run_fast_riders, 'Times of the 5am Debden starters relative to 100 hour pace.'),
+        ('finishes', run_finishes, 'Histogram of finish times.'),
+        ('my-times', run_my_times, 'Times of Tom B and Mark B.'),
+    ]
+    for name, func, description in plots:
+        subparser = subparsers.add_parser(name, help=description)
+        subparser.add_argument('-o', '--output', help='Where to save the figure.')
+        subparser.add_argument('--dpi', type=int, default=300)
+        subparser.add_argument('--no-show', dest='show', action='store_false', help="Don't open a window.")
+        subparser.set_defaults(func=func)
+
+    for name in ['times', 'fast-riders', 'finishes']:
+        subparsers.choices[name].add_argument('--db', help='Read the riders from this SQLite database (see export) instead of the CSV.')
+
+    times = subparsers.choices['times']
+    times.add_argument('--density', action='store_true', default=None, help='Draw a density image instead of lines.')
+    times.add_argument('--lines', dest='density', action='store_false', help='Always draw one line per rider.')
+    times.add_argument('--impute', action='store_true', help='Fill in isolated skipped controls instead of treating them as DNFs.')
+    times.add_argument('--bands', action='store_true', help='Draw percentile bands, streamed from the CSV, instead of riders.')
+
+    stats = subparsers.add_parser('stats', help='Print finish time counts.')
+    stats.add_argument('--data', help='Path to the rider data CSV.')
+    stats.add_argument('--db', help='Read the riders from this SQLite database (see export) instead.')
+    stats.add_argument('--finished', action='store_true', default=None, help='With --db, only riders who finished.')
+    stats.add_argument('--dnf', dest='finished', action='store_false', help="With --db, only riders who didn't finish.")
+    stats.add_argument('--start-location', help='With --db, only riders who started here.')
+    stats.add_argument('--start-time', help="With --db, only riders in this start wave, e.g. '07/08/2022 05:00'.")
+    stats.add_argument('--reached', nargs=2, metavar=('CONTROL', 'HOURS'), help='With --db, only riders who reached CONTROL within HOURS.')
+    stats.set_defaults(func=run_stats)
+
+    validate = subparsers.add_parser('validate', help='Report skipped controls, impossible times and other anomalies.')
+    validate.add_argument('--data', help='Path to the rider data CSV.')
+    validate.add_argument('--max-speed', type=float, default=40.0, help='Flag stages ridden faster than this (km/h).')
+    validate.add_argument('-o', '--output', help='Write the per-rider report to this CSV file.')
+    validate.set_defaults(func=run_validate)
+
+    stops = subparsers.add_parser('stops', help='Find long (sleep) stops and count where riders slept.')
+    stops.add_argument('--data', help='Path to the rider data CSV.')
+    stops.add_argument('--min-hours', type=float, default=3.0, help='Only count stages at least this many hours slower than expected.')
+    stops.add_argument('-o', '--output', help='Write the per-control table to this CSV file.')
+    stops.set_defaults(func=run_stops)
+
+    predict = subparsers.add_parser('predict', help='Predict finish times and cut-off risk for riders still on the road.')
+    predict.add_argument('data', help='CSV of the control times so far.')
+    predict.add_argument('--history', help='CSV of a finished event to train on (default: 2022).')
+    predict.set_defaults(func=run_predict)
+
+    export = subparsers.add_parser('export', help='Export the rider data to a SQLite database.')
+    export.add_argument('--data', help='Path to the rider data CSV.')
+    export.add_argument('-o', '--output', help='Where to write the database.')
+    export.set_defaults(func=run_export)
+
+    follow = subparsers.add_parser('follow', help='Follow a growing arrivals file and keep the summaries up to date.')
+    follow.add_argument('path', help='The arrivals file (Rider,Control,Time lines).')
+    follow.add_argument('--interval', type=float, default=5.0, help='Seconds between refreshes.')
+    follow.set_defaults(func=run_follow)
+
+    args = parser.parse_args(argv)
+    if getattr(args, 'bands', False) and args.db:
+        parser.error('--bands streams from the CSV, it can\'t be used with --db')
+
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    if args.profile or args.trace:
+        import instrument
+
+        instrument.write_on_exit(args.profile, args.trace)
+
+    args.func(args)
+
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,244 @@
+import itertools
+import sys
+import numpy as np
+
+from instrument import instrumented
+from rider_data import CONTROLS, load_rider_data
+
+# Two riders rode together if they arrived within this many minutes of each
+# other at every one of at least MIN_CONTROLS consecutive controls.
+TOLERANCE_MINUTES = 5
+MIN_CONTROLS = 3
+
+# The most candidate pairs compared at once.
+MAX_CANDIDATES = 10_000_000
+
+
+def read_in_data():
+    rider_data, _ = load_rider_data()
+
+    return rider_data
+
+
+def close_pairs(points, tolerance):
+    # All pairs of rows of points (riders x dimensions, no NaNs) which are
+    # within tolerance of each other in every dimension, as two arrays of
+    # row numbers (first < second). Rather than comparing every pair, each
+    # point goes into a grid cell of width tolerance, so a close pair is
+    # always in the same or a neighbouring cell. The cells are packed into
+    # sorted integer keys, and each neighbouring cell is looked up with one
+    # searchsorted, so only riders in nearby cells are ever compared.
+    n_points, n_dims = points.shape
+    if n_points < 2:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+
+    # Cells start at 1, so that a neighbour's key can't wrap into the
+    # previous dimension.
+    cells = np.floor((points - points.min(axis=0)) / tolerance).astype(np.int64) + 1
+    strides = np.cumprod(np.concatenate([[1], cells.max(axis=0)[:-1] + 2]))
+    keys = cells @ strides
+
+    order = np.argsort(keys, kind='stable')
+    sorted_keys = keys[order]
+
+    # Look up the occupied cells, rather than every point, as many riders
+    # can share one.
+    cells, cell_starts, cell_counts = np.unique(sorted_keys, return_index=True, return_counts=True)
+    point_cells = np.repeat(np.arange(len(cells)), cell_counts)
+
+    firsts = []
+    seconds = []
+
+    # Only half of the neighbouring cells need looking at, as the other half
+    # give the same pairs the other way round: those whose first non-zero
+    # offset is positive, plus the point's own cell.
+    for offset in itertools.product([-1, 0, 1], repeat=n_dims):
+        nonzero = [o for o in offset if o]
+        if nonzero and nonzero[0] < 0:
+            continue
+
+        if nonzero:
+            neighbours = cells + np.dot(offset, strides)
+            found = np.minimum(np.searchsorted(cells, neighbours), len(cells) - 1)
+            occupied = cells[found] == neighbours
+
+            lo = np.where(occupied, cell_starts[found], 0)[point_cells]
+            hi = lo + np.where(occupied, cell_counts[found], 0)[point_cells]
+        else:
+            # In its own cell, a point is only paired with those after it.
+            lo = np.arange(n_points) + 1
+            hi = (cell_starts + cell_counts)[point_cells]
+
+        counts = np.maximum(hi - lo, 0)
+
+        # Expand the candidates a block of points at a time, so that a
+        # crowded stretch of road can't use an unbounded amount of memory.
+        ends = np.cumsum(counts)
+        block_ends = np.searchsorted(ends, np.arange(MAX_CANDIDATES, ends[-1], MAX_CANDIDATES))
+        for start, end in zip(np.r_[0, block_ends], np.r_[block_ends, n_points]):
+            block_counts = counts[start:end]
+            n_candidates = block_counts.sum()
+
+            first = np.repeat(np.arange(start, end), block_counts)
+            second = np.repeat(lo[start:end] - np.cumsum(block_counts) + block_counts, block_counts) + np.arange(n_candidates)
+
+            first, second = order[first], order[second]
+            close = np.all(np.abs(points[first] - points[second]) <= tolerance, axis=1)
+
+            firsts.append(np.minimum(first, second)[close])
+            seconds.append(np.maximum(first, second)[close])
+
+    return np.concatenate(firsts), np.concatenate(seconds)
+
+
+@instrumented('window_pairs', rows=lambda result: sum(len(first) for _, first, _ in result))
+def window_pairs(rider_data, tolerance=TOLERANCE_MINUTES, min_controls=MIN_CONTROLS):
+    # For each window of min_controls consecutive controls, the pairs of
+    # riders with close arrival times at all of them (see close_pairs), as
+    # a list of (first control of the window, riders, other riders).
+    n_controls = rider_data.shape[1]
+
+    pairs = []
+    for c in range(n_controls - min_controls + 1):
+        window = rider_data[:, c:c + min_controls]
+        riders = np.flatnonzero(~np.isnan(window).any(axis=1))
+
+        first, second = close_pairs(window[riders], tolerance)
+        pairs.append((c, riders[first], riders[second]))
+
+    return pairs
+
+
+def pair_runs(window_pairs, min_controls=MIN_CONTROLS):
+    # Join the pairs found in overlapping windows into runs. Returns one row
+    # per run as (rider, other rider, first control, last control), with
+    # rider < other rider.
+    pairs = [np.column_stack([first, second, np.full(len(first), c)]) for c, first, second in window_pairs]
+
+    pairs = np.concatenate(pairs) if pairs else np.empty((0, 3), dtype=np.int64)
+    if not len(pairs):
+        return np.empty((0, 4), dtype=np.int64)
+
+    # Sort by pair, then window, and start a new run wherever the pair
+    # changes or a window is missed.
+    pairs = pairs[np.lexsort((pairs[:, 2], pairs[:, 1], pairs[:, 0]))]
+    new_run = np.ones(len(pairs), dtype=bool)
+    new_run[1:] = (
+        (pairs[1:, 0] != pairs[:-1, 0])
+        | (pairs[1:, 1] != pairs[:-1, 1])
+        | (pairs[1:, 2] != pairs[:-1, 2] + 1)
+    )
+
+    starts = np.flatnonzero(new_run)
+    ends = np.append(starts[1:], len(pairs)) - 1
+
+    return np.column_stack([
+        pairs[starts, 0],
+        pairs[starts, 1],
+        pairs[starts, 2],
+        pairs[ends, 2] + min_controls - 1,
+    ])
+
+
+def connected_riders(first, second, n_riders):
+    # Label the riders joined by pairs (directly or through someone else)
+    # with the smallest rider number in their group. Every label points at
+    # a smaller (or the same) rider, so in each round the larger of the two
+    # labels of every unfinished pair is hooked onto the smaller one, and
+    # then every label is followed to the end of its chain. This takes a
+    # handful of rounds, however long the chains of riders are. Riders who
+    # aren't in any pair get -1.
+    labels = np.arange(n_riders)
+
+    while True:
+        a, b = labels[first], labels[second]
+        unfinished = a != b
+        if not unfinished.any():
+            break
+
+        labels[np.maximum(a, b)[unfinished]] = np.minimum(a, b)[unfinished]
+
+        while True:
+            jumped = labels[labels]
+            if np.array_equal(jumped, labels):
+                break
+            labels = jumped
+
+    in_pair = np.zeros(n_riders, dtype=bool)
+    in_pair[first] = True
+    in_pair[second] = True
+
+    return np.where(in_pair, labels, -1)
+
+
+def group_runs(window_pairs, n_riders, n_controls, min_controls=MIN_CONTROLS):
+    # Find the groups of riders who rode together. In each window, riders
+    # joined by close pairs form a group. Joining pairs over the whole route
+    # instead would chain everyone together (A rode with B on day one, B
+    # with C on day two, ...), so a group only carries on into the next
+    # window while it has exactly the same riders. Returns a list of
+    # (riders, first control, last control), largest groups first.
+    groups = []
+    previous = {}
+
+    for c, first, second in window_pairs:
+        labels = connected_riders(first, second, n_riders)
+
+        riders = np.flatnonzero(labels >= 0)
+        riders = riders[np.argsort(labels[riders], kind='stable')]
+        boundaries = np.flatnonzero(np.diff(labels[riders])) + 1
+
+        current = {}
+        for members in np.split(riders, boundaries) if len(riders) else []:
+            key = tuple(members.tolist())
+            current[key] = previous.pop(key, c)
+
+        # Groups which didn't carry on ended in the last window.
+        groups += [(np.array(key), start, c - 1 + min_controls - 1) for key, start in previous.items()]
+        previous = current
+
+    groups += [(np.array(key), start, n_controls - 1) for key, start in previous.items()]
+
+    return sorted(groups, key=lambda group: (-len(group[0]), group[1]))
+
+
+@instrumented('companions', rows=lambda result: len(result[0]))
+def find_companions(rider_data, tolerance=TOLERANCE_MINUTES, min_controls=MIN_CONTROLS):
+    # Find everyone who rode with someone else: the runs of pairs of riders
+    # (see pair_runs) and the groups (see group_runs). Riders rode together
+    # over a window of min_controls consecutive controls if they arrived
+    # within tolerance minutes of each other at every one of them.
+    pairs = window_pairs(rider_data, tolerance, min_controls)
+    n_riders, n_controls = rider_data.shape
+
+    return pair_runs(pairs, min_controls), group_runs(pairs, n_riders, n_controls, min_controls)
+
+
+def main():
+    rider_data = read_in_data() if len(sys.argv) < 2 else load_rider_data(sys.argv[1])[0]
+
+    runs, groups = find_companions(rider_data)
+
+    lengths = runs[:, 3] - runs[:, 2] + 1
+    grouped = np.unique(np.concatenate([members for members, _, _ in groups])) if groups else []
+
+    print(f'Pairs who rode together for {MIN_CONTROLS}+ controls (within {TOLERANCE_MINUTES} minutes): {len(np.unique(runs[:, :2], axis=0))}')
+    print(f'Riders who rode with someone: {len(grouped)} of {len(rider_data)}')
+
+    # The longest runs together.
+    longest = np.argsort(-lengths, kind='stable')[:10]
+
+    print(f'\n{"Riders":>13} {"Controls":>9}  From -> To')
+    for r in longest:
+        a, b, first, last = runs[r]
+        print(f'{f"{a} & {b}":>13} {lengths[r]:>9}  {CONTROLS[first]} -> {CONTROLS[last]}')
+
+    # The largest groups.
+    print(f'\n{"Size":>5} {"Controls":>9}  From -> To')
+    for members, first, last in groups[:10]:
+        print(f'{len(members):>5} {last - first + 1:>9}  {CONTROLS[first]} -> {CONTROLS[last]}  (riders {", ".join(map(str, members[:6]))}{", ..." if len(members) > 6 else ""})')
+
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+import argparse
+import csv
+import numpy as np
+
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from pace import elapsed_hours
+from rider_data import PATH_TO_ROUTES, load_rider_data, load_route
+
+SUMMARY_FIELDS = [
+    'edition',
+    'riders',
+    'starters',
+    'outside_start_waves',
+    'finish_no_start',
+    'finishers',
+    'within_cut_off',
+    'completion_rate',
+    'fastest_hours',
+    'median_hours',
+    'most_abandoned_after',
+]
+
+
+def summarise_edition(route_path, data_path=None):
+    # Summarise one edition of an event: how many riders started, finished
+    # and finished within the cut-off, and where most of the DNFs happened.
+    route = load_route(route_path)
+    rider_data, _ = load_rider_data(data_path, route=route)
+
+    start_times = rider_data[:, 0]
+    end_times = rider_data[:, -1]
+    started = ~np.isnan(start_times)
+
+    finish_times = elapsed_hours(rider_data)[:, -1]
+    finish_times = finish_times[~np.isnan(finish_times)]
+
+    # The last control each DNF reached, counting riders without a start time
+    # as having abandoned at the start.
+    dnf = np.isnan(end_times)
+    reached = ~np.isnan(rider_data)
+    last_control = rider_data.shape[1] - 1 - np.argmax(reached[:, ::-1], axis=1)
+    last_control = np.where(started & reached.any(axis=1), last_control, 0)
+    abandoned = np.bincount(last_control[dnf], minlength=rider_data.shape[1])
+
+    return {
+        'edition': route['name'],
+        'riders': len(rider_data),
+        'starters': int(np.sum(started)),
+        'outside_start_waves': int(np.sum(started & ~np.isin(start_times, route['start_waves']))),
+        'finish_no_start': int(np.sum(~np.isnan(end_times) & ~started)),
+        'finishers': len(finish_times),
+        'within_cut_off': int(np.sum(finish_times < route['cut_off_hours'])),
+        'completion_rate': round(len(finish_times) / max(np.sum(started), 1), 3),
+        'fastest_hours': float(np.min(finish_times)) if len(finish_times) else np.nan,
+        'median_hours': float(np.median(finish_times)) if len(finish_times) else np.nan,
+        'most_abandoned_after': route['controls'][np.argmax(abandoned)] if np.any(dnf) else '',
+    }
+
+
+def summarise_editions(route_paths, max_workers=None):
+    # Each edition is loaded and summarised in its own worker process, and
+    # the summaries come back in the same order as the routes.
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(summarise_edition, route_paths))
+
+
+def write_summary(summaries, path):
+    with open(path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=SUMMARY_FIELDS)
+        writer.writeheader()
+        writer.writerows(summaries)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare several editions of an event, one route file each.')
+    parser.add_argument('routes', nargs='*', help='Route JSON files (default: every file in routes/).')
+    parser.add_argument('--output', default='editions_summary.csv', help='Write the comparison to this CSV file.')
+    parser.add_argument('--workers', type=int, help='Number of worker processes (default: one per core).')
+    args = parser.parse_args()
+
+    route_paths = args.routes or sorted(PATH_TO_ROUTES.glob('*.json'))
+
+    summaries = summarise_editions(route_paths, max_workers=args.workers)
+    write_summary(summaries, args.output)
+
+    print(f'{"Edition":<20} {"Riders":>7} {"Starters":>9} {"Finishers":>10} {"In time":>8} {"Rate":>6} {"Fastest":>8} {"Median":>7}  Most DNFs after')
+    for s in summaries:
+        print(
+            f'{s["edition"]:<20} {s["riders"]:>7} {s["starters"]:>9} {s["finishers"]:>10} {s["within_cut_off"]:>8} '
+            f'{s["completion_rate"]:>6.1%} {s["fastest_hours"]:>8.2f} {s["median_hours"]:>7.2f}  {s["most_abandoned_after"]}'
+        )
+
+    print(f'\nWrote {Path(args.output)}')
+
+
+
+if __name__ == '__main__':
+    main()
@@ -1,93 +1,44 @@
-import csv
-from turtle import width
 import numpy as np
-import matplotlib.pyplot as plt
-from matplotlib import cm
-
-from datetime import datetime
-from pathlib import Path
-
-PATH_TO_DATA = Path(__file__).parent.joinpath('data', 'LEL2022_anonymous_rider_data.csv')
-TIME_FORMAT = '%d/%m/%Y %H:%M'
-
-CONTROL_DISTANCES = {
-    'Start': 0.0,
-    'StIvesNorthbound': 99.6,
-    'BostonNorthbound': 188.8,
-    'LouthNorthbound':  241.9,
-    'HessleNorthbound': 299.8,
-    'MaltonNorthbound': 366.7,
-    'BarnardCastle Northbound': 480.1,
-    'BramptonNorthbound': 563.5,
-    'MoffatNorthbound': 637.5,
-    'Dunfermline': 748.6,
-    'InnerleithenSouthbound': 829.9,
-    'EskdalemuirSouthbound': 879.2,
-    'BramptonSouthbound': 938.5,
-    'BarnardCastleSouthbound': 1022.1,
-    'MaltonSouthbound': 1133.9,
-    'HessleSouthbound': 1200.7,
-    'LouthSouthbound': 1259.1,
-    'BostonSouthbound': 1312.1,
-    'St IvesSouthbound': 1401.5,
-    'GreatEastonSouthbound': 1471.8,
-    'DebdenFinish': 1519.9,
-}
-
-CONTROLS = [k for k, v in sorted(CONTROL_DISTANCES.items(), key=lambda item: item[1])]
-
-def read_datetime(time):
-    try:
-        return datetime.strptime(time, TIME_FORMAT)
-    except ValueError:
-        return None
-
-
-def read_in_data():
-    with open(PATH_TO_DATA, 'r') as f:
-        # Each row is an OrderedDict, with the keys as the locations
-        # and the value as a datatime string.
-        rider_data = [row for row in csv.DictReader(f)]
-
-    # Remove the 'Start Location' key-value pair, as that is an exception
-    # to the rest of the data.
-    for row in rider_data:
-        del row['Start Location']
-
-    return rider_data
 
+from instrument import instrumented, stage
+from rider_data import CUT_OFF_HOURS, load_rider_data
+from rider_db import query_rider_data
 
-def calculate_finish_times(rider_data):
-    # We want to analyse the times of each rider, relative to the start time.
-    # So convert each datetime string to a datetime object, and subtract the
-    # start time from each of the other times.
-    finish_times = []
 
-    n_finish_no_start = 0
+def read_in_data(db_path=None):
+    # From the CSV, or from a database made by rider_db.export_sqlite.
+    if db_path:
+        rider_data, _ = query_rider_data(db_path)
+    else:
+        rider_data, _ = load_rider_data()
 
-    for row in rider_data:
-        # Convert the start and end times to a datetime object.
-        start_time = read_datetime(row['Start'])
-        end_time = read_datetime(row['DebdenFinish'])
+    return rider_data
 
-        if end_time is not None and start_time is None:
-            n_finish_no_start += 1
 
-        if start_time is None or end_time is None:
-            continue
+@instrumented('finish_times')
+def calculate_finish_times(rider_data):
+    # We want to analyse the times of each rider, relative to the start time.
+    # So subtract each rider's start time from their finish time, skipping
+    # anyone who is missing either.
+    start_times = rider_data[:, 0]
+    end_times = rider_data[:, -1]
 
-        diff_hours = (end_time - start_time).total_seconds() / 3600
-        diff_hours = np.round(diff_hours, 2)
+    n_finish_no_start = np.sum(~np.isnan(end_times) & np.isnan(start_times))
 
-        finish_times.append(diff_hours)
+    finished = ~np.isnan(start_times) & ~np.isnan(end_times)
+    finish_times = (end_times[finished] - start_times[finished]) / 60
+    finish_times = np.round(finish_times, 2)
 
     print(f'Number of riders with a finish time but no start time: {n_finish_no_start}')
 
     return finish_times
 
 
-def main():
-    rider_data = read_in_data()
+def main(output_path='finish_times.png', dpi=300, show=True, db_path=None):
+    # Only import matplotlib when actually plotting, it is slow to import.
+    import matplotlib.pyplot as plt
+
+    rider_data = read_in_data(db_path)
 
     finish_times = calculate_finish_times(rider_data)
 
@@ -106,7 +57,7 @@ def main():
     y_lim = ax.get_ylim()
     n_max = int(y_lim[1])
 
-    x_special = [100, 128.33]
+    x_special = [100, CUT_OFF_HOURS]
     colours = ['r', 'k']
     for i, x in enumerate(x_special):
         plt.plot([x] * n_max, np.arange(n_max), f'{colours[i]}--', lw=2)
@@ -122,7 +73,7 @@ def main():
 
     # Show totals
     n_100 = np.sum(np.array(finish_times) < 100)
-    n_128 = np.sum(np.array(finish_times) < 128.33) - n_100
+    n_128 = np.sum(np.array(finish_times) < CUT_OFF_HOURS) - n_100
     n_dnf = len(finish_times) - n_100 - n_128
 
     plt.text(
@@ -136,7 +87,7 @@ def main():
     plt.text(
         64,
         n_max - 57,
-        f'{n_128} between 100 and 128.33 hours',
+        f'{n_128} between 100 and {CUT_OFF_HOURS} hours',
         ha='left',
         va='top',
         fontsize=18,
@@ -144,7 +95,7 @@ def main():
     plt.text(
         64,
         n_max - 67,
-        f'{n_dnf} after 128.33 hours',
+        f'{n_dnf} after {CUT_OFF_HOURS} hours',
         ha='left',
         va='top',
         fontsize=18,
@@ -187,9 +138,11 @@ def main():
     fig = plt.gcf()
     fig.set_size_inches(15, 10)
 
-    #plt.savefig('finish_times.png', dpi=300)
+    with stage('render'):
+        plt.savefig(output_path, dpi=dpi)
 
-    plt.show()
+    if show:
+        plt.show()
 
 
 
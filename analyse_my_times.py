@@ -1,38 +1,10 @@
-import csv
-from resource import RLIMIT_RSS
-from turtle import color
 import numpy as np
-import matplotlib.pyplot as plt
-from matplotlib import cm
 
-from datetime import datetime
-from pathlib import Path
+from instrument import stage
+from pace import pace_deviations
+from rider_data import CONTROL_DISTANCES, CONTROLS, CUT_OFF_HOURS, load_rider_data, parse_times
+from rider_stops import field_speeds, find_stops, place_name
 
-TIME_FORMAT = '%d/%m/%Y %H:%M'
-
-CONTROL_DISTANCES = {
-    'Start': 0.0,
-    'StIvesNorthbound': 99.6,
-    'BostonNorthbound': 188.8,
-    'LouthNorthbound':  241.9,
-    'HessleNorthbound': 299.8,
-    'MaltonNorthbound': 366.7,
-    'BarnardCastle Northbound': 480.1,
-    'BramptonNorthbound': 563.5,
-    'MoffatNorthbound': 637.5,
-    'Dunfermline': 748.6,
-    'InnerleithenSouthbound': 829.9,
-    'EskdalemuirSouthbound': 879.2,
-    'BramptonSouthbound': 938.5,
-    'BarnardCastleSouthbound': 1022.1,
-    'MaltonSouthbound': 1133.9,
-    'HessleSouthbound': 1200.7,
-    'LouthSouthbound': 1259.1,
-    'BostonSouthbound': 1312.1,
-    'St IvesSouthbound': 1401.5,
-    'GreatEastonSouthbound': 1471.8,
-    'DebdenFinish': 1519.9,
-}
 RIDER1_TIMES = {
     'Start': '07/08/2022 12:30',
     'StIvesNorthbound': '07/08/2022 16:32',
@@ -80,70 +52,28 @@ RIDER2_TIMES = {
     'DebdenFinish': '12/08/2022 11:28',
 }
 
-CONTROLS = [k for k, v in sorted(RIDER1_TIMES.items(), key=lambda item: item[1])]
-
-def read_datetime(time):
-    try:
-        return datetime.strptime(time, TIME_FORMAT)
-    except ValueError:
-        return None
-
 
 def calculate_relative_times(rider_data):
-    # We want to analyse the times of each rider, relative to the start time.
-    # So convert each datetime string to a datetime object, and subtract the
-    # start time from each of the other times.
-    rider_times = []
-
-    for row in rider_data:
-
-        # Convert the start time to a datetime object.
-        start_time = read_datetime(row['Start'])
-
-        if start_time is None:
-            continue
-
-        # Convert each of the other times to a datetime object, and subtract
-        # the start time from it.
-        relative_times = []
-        for c in CONTROLS:
-            time = read_datetime(row[c])
-
-            if time is not None:
-                diff_hours = (time - start_time).total_seconds() / 3600
-                diff_hours = np.round(diff_hours, 2)
-            else:
-                diff_hours = None
-
-            relative_times.append(diff_hours)
-
-        rider_times.append(relative_times)
-
+    # We want to analyse the times of each rider, relative to the start time,
+    # and then relative to the average pace required to finish within the 128 hour 20 min cut-off.
+    # Skip any riders without a start time.
+    rider_data = rider_data[~np.isnan(rider_data[:, CONTROLS.index('Start')])]
 
-    # We now want to calculate the times relative to the average pace
-    # required to finish with the 128 hour 20 min cut-off.
-    reference_speed = CONTROL_DISTANCES['DebdenFinish'] / 128.33
-    reference_times = [CONTROL_DISTANCES[loc] / reference_speed for loc in CONTROL_DISTANCES]
+    return pace_deviations(rider_data, [CUT_OFF_HOURS])[:, :, 0]
 
-    # Now subtract the reference times from the rider times.
-    for rider in rider_times:
-        for i, time in enumerate(rider):
-            if time is not None:
-                rider[i] = time - reference_times[i]
 
-    return rider_times
+def main(output_path='my_times.png', dpi=300, show=True):
+    # Only import matplotlib when actually plotting, it is slow to import.
+    import matplotlib.pyplot as plt
 
-
-def main():
-    rider_data = [RIDER1_TIMES, RIDER2_TIMES]
+    rider_data = parse_times([[rider[c] for c in CONTROLS] for rider in [RIDER1_TIMES, RIDER2_TIMES]])
 
     rider_times = calculate_relative_times(rider_data)
 
-    locations = list(CONTROL_DISTANCES.keys())
-    locations = [loc.replace('Northbound', ' (N)') for loc in locations]
+    locations = [loc.replace('Northbound', ' (N)') for loc in CONTROLS]
     locations = [loc.replace('Southbound', ' (S)') for loc in locations]
 
-    distances = list(CONTROL_DISTANCES.values())
+    distances = [CONTROL_DISTANCES[loc] for loc in CONTROLS]
 
     colours = ['darkblue', 'darkred']
 
@@ -156,86 +86,26 @@ def main():
     # Add dashed black line to emphasise the 128 hour 20 min cut-off.
     plt.plot(distances, [0] * len(locations), 'k--', lw=2)
 
-    arrowprops = [
-        dict(facecolor=colours[0], edgecolor=colours[0], shrink=0.05, width=0.5, headwidth=5),
-        dict(facecolor=colours[1], edgecolor=colours[1], shrink=0.05, width=0.5, headwidth=5),
-    ]
+    # Annotate each rider's sleep stops, as found by comparing their stages
+    # with their own pace and the rest of the field's. Tom B's labels go
+    # above his line and Mark B's below.
+    field_data, _ = load_rider_data()
+    stops = find_stops(rider_data, field_speeds(field_data))
 
-    # Annotate sleep stops (Tom B)
-    plt.annotate(
-        'Sleep at Premier Inn\nbefore Hessle',
-        xy=(CONTROL_DISTANCES['LouthNorthbound'], -8.5),
-        xytext=(CONTROL_DISTANCES['LouthNorthbound'], -2.5),
-        arrowprops=arrowprops[0],
-        ha='left',
-        color=colours[0],
-    )
-    plt.annotate(
-        'Sleep at\nBrampton',
-        xy=(CONTROL_DISTANCES['BramptonNorthbound'], -12),
-        xytext=(CONTROL_DISTANCES['BramptonNorthbound'], -5.5),
-        arrowprops=arrowprops[0],
-        ha='left',
-        color=colours[0],
-    )
-    plt.annotate(
-        'Sleep at\nInnerleithen',
-        xy=(CONTROL_DISTANCES['InnerleithenSouthbound'], -13.2),
-        xytext=(CONTROL_DISTANCES['InnerleithenSouthbound'], -4.9),
-        arrowprops=arrowprops[0],
-        ha='left',
-        color=colours[0],
-    )
-    plt.annotate(
-        'Sleep at\nMalton',
-        xy=(CONTROL_DISTANCES['MaltonSouthbound'], -13),
-        xytext=(CONTROL_DISTANCES['MaltonSouthbound'], -6.5),
-        arrowprops=arrowprops[0],
-        ha='left',
-        color=colours[0],
-    )
-    plt.annotate(
-        'Sleep at\nSt. Ives',
-        xy=(CONTROL_DISTANCES['St IvesSouthbound'], -13),
-        xytext=(CONTROL_DISTANCES['St IvesSouthbound'], -6.5),
-        arrowprops=arrowprops[0],
-        ha='left',
-        color=colours[0],
-    )
+    offsets = [6, -5]
 
-    # Annotate sleep stops (Mark B)
-    plt.annotate(
-        'Sleep at\nBrampton',
-        xy=(CONTROL_DISTANCES['BramptonNorthbound'], -17),
-        xytext=(CONTROL_DISTANCES['BramptonNorthbound'], -22),
-        arrowprops=arrowprops[1],
-        ha='left',
-        color=colours[1],
-    )
-    plt.annotate(
-        'Sleep at\nBrampton',
-        xy=(CONTROL_DISTANCES['BramptonSouthbound'], -18.5),
-        xytext=(CONTROL_DISTANCES['BramptonSouthbound'], -23),
-        arrowprops=arrowprops[1],
-        ha='left',
-        color=colours[1],
-    )
-    plt.annotate(
-        'Sleep at\nMalton',
-        xy=(CONTROL_DISTANCES['MaltonSouthbound'], -17.5),
-        xytext=(CONTROL_DISTANCES['MaltonSouthbound'], -22),
-        arrowprops=arrowprops[1],
-        ha='left',
-        color=colours[1],
-    )
-    plt.annotate(
-        '(Waited for\nTom B to\ncatch up!)\nSleep at\nSt. Ives',
-        xy=(CONTROL_DISTANCES['St IvesSouthbound'], -16.5),
-        xytext=(CONTROL_DISTANCES['St IvesSouthbound'], -22.5),
-        arrowprops=arrowprops[1],
-        ha='left',
-        color=colours[1],
-    )
+    for i, times in enumerate(rider_times):
+        arrowprops = dict(facecolor=colours[i], edgecolor=colours[i], shrink=0.05, width=0.5, headwidth=5)
+
+        for c in np.flatnonzero(~np.isnan(stops[i])):
+            plt.annotate(
+                f'Sleep at\n{place_name(CONTROLS[c])}',
+                xy=(distances[c], times[c]),
+                xytext=(distances[c], times[c] + offsets[i % 2]),
+                arrowprops=arrowprops,
+                ha='left',
+                color=colours[i],
+            )
 
     # Add text to finish point
     plt.plot(
@@ -247,7 +117,7 @@ def main():
         markeredgewidth=1,
         markeredgecolor='white',
     )
-    total_time = rider_times[0][-1] + 128.33
+    total_time = rider_times[0][-1] + CUT_OFF_HOURS
     plt.text(
         CONTROL_DISTANCES['DebdenFinish'],
         rider_times[0][-1] - 2,
@@ -279,9 +149,11 @@ def main():
     fig = plt.gcf()
     fig.set_size_inches(12, 10)
 
-    plt.savefig('my_times.png', dpi=300)
+    with stage('render'):
+        plt.savefig(output_path, dpi=dpi)
 
-    plt.show()
+    if show:
+        plt.show()
 
 
 
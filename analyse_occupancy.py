@@ -0,0 +1,138 @@
+import sys
+import numpy as np
+
+from instrument import instrumented
+from rider_data import CONTROL_DISTANCES, CONTROLS, format_time, load_rider_data, parse_times
+
+# How long riders are assumed to stay at a control when there is no later
+# control time to estimate it from (i.e. at the finish, or where they DNFed).
+LAST_CONTROL_DWELL = 60.0
+
+
+def read_in_data():
+    rider_data, _ = load_rider_data(truncate_dnf=True)
+
+    return rider_data
+
+
+def estimate_departures(rider_data):
+    # Estimate when each rider left each control. We only know when they
+    # arrived at the next one, so subtract the time the next stage would take
+    # at the rider's moving speed, which we take to be the fastest average
+    # speed they managed on any stage (any stops on that stage make this an
+    # underestimate of their moving speed, and so of their dwell time).
+    distances = np.array([CONTROL_DISTANCES[loc] for loc in CONTROLS])
+    stage_distances = np.diff(distances)
+
+    stage_minutes = np.diff(rider_data, axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        stage_speeds = np.where(stage_minutes > 0, stage_distances / stage_minutes, np.nan)
+
+    moving_speed = np.full(len(rider_data), np.nan)
+    has_speed = np.any(~np.isnan(stage_speeds), axis=1)
+    moving_speed[has_speed] = np.nanmax(stage_speeds[has_speed], axis=1)
+
+    departures = rider_data[:, 1:] - stage_distances / moving_speed[:, None]
+
+    # Never leave before arriving, or after arriving at the next control.
+    departures = np.clip(departures, rider_data[:, :-1], rider_data[:, 1:])
+
+    # A next control time earlier than this one (bad data) says nothing
+    # about when they left, so treat it as missing.
+    departures[rider_data[:, 1:] < rider_data[:, :-1]] = np.nan
+
+    # Without a next control time, fall back to a fixed dwell.
+    departures = np.column_stack([departures, np.full(len(rider_data), np.nan)])
+    no_departure = np.isnan(departures) & ~np.isnan(rider_data)
+    departures[no_departure] = rider_data[no_departure] + LAST_CONTROL_DWELL
+
+    return departures
+
+
+@instrumented('occupancy', rows=lambda result: result[0].shape[1])
+def calculate_occupancy(rider_data):
+    # The number of riders at each control in every minute of the event, and
+    # the number approaching it (having left the previous control, but not
+    # yet arrived), as two (controls x minutes) arrays, along with the time
+    # of the first minute. Each visit or stage is a start event (+1) and an
+    # end event (-1). The events are accumulated into per-minute bins and a
+    # running sum over the minutes gives the counts, so the cost is linear
+    # in the number of events plus the length of the event.
+    departures = estimate_departures(rider_data)
+
+    visited = ~np.isnan(rider_data)
+    controls = np.broadcast_to(np.arange(len(CONTROLS)), rider_data.shape)
+    arrive = rider_data[visited].astype(np.int64)
+    leave = np.ceil(departures[visited]).astype(np.int64)
+
+    # The stage into each control runs from leaving the previous control to
+    # arriving at this one. Riders who never arrived (DNFs), or whose
+    # (fallback) departure isn't before the arrival, as with bad data, aren't
+    # counted as approaching.
+    with np.errstate(invalid='ignore'):
+        on_stage = visited[:, 1:] & (departures[:, :-1] <= rider_data[:, 1:])
+    stage_start = np.ceil(departures[:, :-1][on_stage]).astype(np.int64)
+    stage_end = rider_data[:, 1:][on_stage].astype(np.int64)
+
+    t0 = arrive.min()
+    n_minutes = leave.max() - t0 + 1
+
+    def count_intervals(interval_controls, starts, ends):
+        n_bins = len(CONTROLS) * (n_minutes + 1)
+        starts = np.bincount(interval_controls * (n_minutes + 1) + starts - t0, minlength=n_bins)
+        ends = np.bincount(interval_controls * (n_minutes + 1) + ends - t0, minlength=n_bins)
+        events = (starts - ends).reshape(len(CONTROLS), n_minutes + 1)
+
+        return np.cumsum(events, axis=1)[:, :-1]
+
+    occupancy = count_intervals(controls[visited], arrive, leave)
+    approaching = count_intervals(controls[:, 1:][on_stage], stage_start, stage_end)
+
+    return occupancy, approaching, t0
+
+
+def peak_occupancy(occupancy, t0):
+    # The peak number of riders at each control, and when it happened.
+    peak_minute = np.argmax(occupancy, axis=1)
+    peak_load = occupancy[np.arange(len(occupancy)), peak_minute]
+
+    return peak_load, peak_minute + t0
+
+
+def occupancy_at(occupancy, t0, control, time):
+    # The number of riders at a control at a given time, e.g.
+    # occupancy_at(occupancy, t0, 'BramptonSouthbound', '10/08/2022 02:00').
+    # Works the same with the riders approaching a control.
+    minute = int(parse_times(time)) - t0
+    if minute < 0 or minute >= occupancy.shape[1]:
+        return 0
+
+    return occupancy[CONTROLS.index(control), minute]
+
+
+def main():
+    rider_data = read_in_data()
+
+    occupancy, approaching, t0 = calculate_occupancy(rider_data)
+
+    if len(sys.argv) == 3:
+        control, time = sys.argv[1:]
+        at = occupancy_at(occupancy, t0, control, time)
+        on_the_way = occupancy_at(approaching, t0, control, time)
+        print(f'Riders at {control} at {time}: {at}, and {on_the_way} approaching it')
+        return
+
+    peak_load, peak_time = peak_occupancy(occupancy, t0)
+    peak_total, peak_total_time = peak_occupancy(occupancy + approaching, t0)
+
+    print(f'{"Control":<26} {"Peak riders":>12}  {"At":<16}  {"Peak at or approaching":>23}  {"At":<16}')
+    for i, c in enumerate(CONTROLS):
+        print(
+            f'{c:<26} {peak_load[i]:>12}  {format_time(peak_time[i])}  '
+            f'{peak_total[i]:>23}  {format_time(peak_total_time[i])}'
+        )
+
+
+
+if __name__ == '__main__':
+    main()
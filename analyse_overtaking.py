@@ -0,0 +1,154 @@
+import numpy as np
+
+from instrument import instrumented
+from rider_data import CONTROLS, load_rider_data
+
+
+def read_in_data():
+    rider_data, _ = load_rider_data(truncate_dnf=True)
+
+    return rider_data
+
+
+@instrumented('positions')
+def calculate_positions(rider_data):
+    # Each rider's position on the road at each control, i.e. the order in
+    # which riders arrived there (1 = first to arrive). Riders arriving in
+    # the same minute share a position, and riders who never reached the
+    # control get NaN. Needs one sort per control.
+    positions = np.full(rider_data.shape, np.nan)
+
+    for c in range(rider_data.shape[1]):
+        times = rider_data[:, c]
+        has_time = ~np.isnan(times)
+
+        sorted_times = np.sort(times[has_time])
+        positions[has_time, c] = np.searchsorted(sorted_times, times[has_time], side='left') + 1
+
+    return positions
+
+
+def count_greater_before(values):
+    # For each element, count how many earlier elements are strictly greater
+    # than it, in O(n log n) without comparing every pair. The values are
+    # replaced by integer ranks, and the ranks are looked at one bit at a
+    # time from the top. An earlier element is greater exactly when, at the
+    # first bit where the two ranks differ, it has a 1 and this element a 0.
+    # So at each bit, among the elements whose ranks agree on all the higher
+    # bits, every element with a 0 counts the earlier elements with a 1.
+    #
+    # The elements are kept ordered by (higher bits, position), and going
+    # down a bit only splits each of those groups into its 0s and then its
+    # 1s, which a few running sums do in linear time, so no level needs a
+    # sort.
+    n = len(values)
+    counts = np.zeros(n, dtype=np.int64)
+    if n < 2:
+        return counts
+
+    ranks = np.unique(values, return_inverse=True)[1].astype(np.int64).reshape(-1)
+    n_bits = int(ranks.max()).bit_length()
+
+    order = np.arange(n)
+    indices = np.arange(n)
+
+    for bit in range(n_bits - 1, -1, -1):
+        sorted_ranks = ranks[order]
+        groups = sorted_ranks >> (bit + 1)
+        ones = (sorted_ranks >> bit) & 1
+
+        # Where each element's group starts in the current order.
+        new_group = np.ones(n, dtype=bool)
+        new_group[1:] = groups[1:] != groups[:-1]
+        group_start = np.maximum.accumulate(np.where(new_group, indices, 0))
+        group_end = np.append(np.flatnonzero(new_group)[1:], n)[np.cumsum(new_group) - 1]
+
+        # The 1s (and 0s) before each element in its group.
+        ones_before = np.cumsum(ones) - ones
+        ones_before -= ones_before[group_start]
+        zeros_before = indices - group_start - ones_before
+
+        counts[order[ones == 0]] += ones_before[ones == 0]
+
+        # Split each group into its 0s then its 1s, keeping their order.
+        ones_in_group = ones_before[group_end - 1] + ones[group_end - 1]
+        zeros_in_group = group_end - group_start - ones_in_group
+        new_positions = group_start + np.where(ones == 1, zeros_in_group + ones_before, zeros_before)
+
+        new_order = np.empty(n, dtype=np.int64)
+        new_order[new_positions] = order
+        order = new_order
+
+    return counts
+
+
+@instrumented('overtaking')
+def calculate_overtaking(rider_data):
+    # For every stage between consecutive controls, count how many riders
+    # each rider overtook (arrived at the first control after them, but at
+    # the second control before them) and was overtaken by. Returns two
+    # (riders x stages) arrays, with NaN for riders who didn't ride the stage.
+    n_riders, n_controls = rider_data.shape
+
+    overtakes = np.full((n_riders, n_controls - 1), np.nan)
+    overtaken = np.full((n_riders, n_controls - 1), np.nan)
+
+    for s in range(n_controls - 1):
+        arrive, arrive_next = rider_data[:, s], rider_data[:, s + 1]
+        on_stage = np.flatnonzero(~np.isnan(arrive) & ~np.isnan(arrive_next))
+
+        # Order riders by arrival at the first control, breaking ties by
+        # arrival at the second, so that riders who arrived together at the
+        # first control never count as overtaking each other.
+        order = on_stage[np.lexsort((arrive_next[on_stage], arrive[on_stage]))]
+        next_times = arrive_next[order]
+
+        # Overtook: arrived at the first control later, and at the next
+        # control earlier, than someone ahead of them in this order.
+        overtakes[order, s] = count_greater_before(next_times)
+
+        # Overtaken: someone behind them in this order arrived at the next
+        # control earlier. Reversing and negating turns this into the same
+        # 'greater before' count.
+        overtaken[order, s] = count_greater_before(-next_times[::-1])[::-1]
+
+    return overtakes, overtaken
+
+
+def stage_summary(overtakes, positions):
+    # Per-stage totals: riders on the stage, total number of overtakes, and
+    # the mean absolute change in road position.
+    n_riders = np.sum(~np.isnan(overtakes), axis=0)
+    n_overtakes = np.nansum(overtakes, axis=0).astype(np.int64)
+
+    position_change = np.abs(np.diff(positions, axis=1))
+    mean_change = np.nanmean(np.where(np.isnan(overtakes), np.nan, position_change), axis=0)
+
+    return n_riders, n_overtakes, mean_change
+
+
+def main():
+    rider_data = read_in_data()
+
+    positions = calculate_positions(rider_data)
+    overtakes, overtaken = calculate_overtaking(rider_data)
+
+    n_riders, n_overtakes, mean_change = stage_summary(overtakes, positions)
+
+    print(f'{"Stage":<52} {"Riders":>7} {"Overtakes":>10} {"Mean position change":>21}')
+    for s in range(len(CONTROLS) - 1):
+        stage = f'{CONTROLS[s]} -> {CONTROLS[s + 1]}'
+        print(f'{stage:<52} {n_riders[s]:>7} {n_overtakes[s]:>10} {mean_change[s]:>21.1f}')
+
+    # Riders who gained the most places over the whole route.
+    net_gain = np.nansum(overtakes, axis=1) - np.nansum(overtaken, axis=1)
+    best = np.argsort(-net_gain, kind='stable')[:10]
+
+    print(f'\n{"Rider":>6} {"Overtook":>9} {"Overtaken by":>13} {"Net":>6}')
+    for r in best:
+        print(f'{r:>6} {int(np.nansum(overtakes[r])):>9} {int(np.nansum(overtaken[r])):>13} {int(net_gain[r]):>6}')
+
+
+
+if __name__ == '__main__':
+    main()
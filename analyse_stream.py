@@ -0,0 +1,94 @@
+import sys
+import numpy as np
+
+from instrument import stage
+from pace import pace_deviations
+from rider_data import CONTROLS, CUT_OFF_HOURS, PATH_TO_DATA, iter_rider_data
+
+FINISH_TIME_BINS = np.linspace(66, 140, 38)
+
+
+def new_summary():
+    # Running totals which are updated one chunk of riders at a time. Each
+    # one has a fixed size, no matter how many riders are streamed through.
+    return {
+        'n_riders': 0,
+        'n_finish_no_start': 0,
+        'finish_counts': np.zeros(len(FINISH_TIME_BINS) - 1, dtype=np.int64),
+        'control_counts': np.zeros(len(CONTROLS), dtype=np.int64),
+        'pace_min': np.full(len(CONTROLS), np.inf),
+        'pace_max': np.full(len(CONTROLS), -np.inf),
+        'pace_sum': np.zeros(len(CONTROLS)),
+        'pace_count': np.zeros(len(CONTROLS), dtype=np.int64),
+    }
+
+
+def update_summary(summary, rider_data):
+    start_times = rider_data[:, 0]
+    end_times = rider_data[:, -1]
+
+    summary['n_riders'] += len(rider_data)
+
+    # Finish time histogram.
+    summary['n_finish_no_start'] += np.sum(~np.isnan(end_times) & np.isnan(start_times))
+
+    finish_times = np.round((end_times - start_times) / 60, 2)
+    finish_times = finish_times[~np.isnan(finish_times)]
+    summary['finish_counts'] += np.histogram(finish_times, bins=FINISH_TIME_BINS)[0]
+
+    # Number of riders reaching each control.
+    reached = ~np.isnan(rider_data)
+    summary['control_counts'] += np.sum(reached, axis=0)
+
+    # Envelope of times relative to the 128 hour 20 min pace at each control.
+    rider_times = pace_deviations(rider_data, [CUT_OFF_HOURS])[:, :, 0]
+    has_time = ~np.isnan(rider_times)
+
+    summary['pace_min'] = np.minimum(summary['pace_min'], np.min(rider_times, axis=0, initial=np.inf, where=has_time))
+    summary['pace_max'] = np.maximum(summary['pace_max'], np.max(rider_times, axis=0, initial=-np.inf, where=has_time))
+    summary['pace_sum'] += np.sum(rider_times, axis=0, where=has_time)
+    summary['pace_count'] += np.sum(has_time, axis=0)
+
+    return summary
+
+
+def summarise(path=PATH_TO_DATA, chunk_size=100_000):
+    summary = new_summary()
+
+    with stage('stream') as record:
+        for rider_data, _ in iter_rider_data(path, chunk_size=chunk_size):
+            update_summary(summary, rider_data)
+
+        record['rows'] = summary['n_riders']
+
+    return summary
+
+
+def main():
+    path = sys.argv[1] if len(sys.argv) > 1 else PATH_TO_DATA
+
+    summary = summarise(path)
+
+    print(f'Number of riders: {summary["n_riders"]}')
+    print(f'Number of riders with a finish time but no start time: {summary["n_finish_no_start"]}')
+
+    print('\nFinish times (hours):')
+    for i, n in enumerate(summary['finish_counts']):
+        print(f'  {FINISH_TIME_BINS[i]:6.1f} - {FINISH_TIME_BINS[i + 1]:6.1f}: {n}')
+
+    # The pace envelope is relative to the start time, so only riders who
+    # have a start time count towards the mean.
+    pace_mean = summary['pace_sum'] / np.maximum(summary['pace_count'], 1)
+
+    print('\nTime behind/ahead of 128 hour pace at each control (hours):')
+    print(f'  {"Control":<26} {"Riders":>7} {"Min":>8} {"Mean":>8} {"Max":>8}')
+    for i, c in enumerate(CONTROLS):
+        print(
+            f'  {c:<26} {summary["control_counts"][i]:>7} '
+            f'{summary["pace_min"][i]:>8.2f} {pace_mean[i]:>8.2f} {summary["pace_max"][i]:>8.2f}'
+        )
+
+
+
+if __name__ == '__main__':
+    main()
@@ -1,173 +1,162 @@
-import csv
 import numpy as np
-import matplotlib.pyplot as plt
-from matplotlib import cm
-
-from datetime import datetime
-from pathlib import Path
-
-PATH_TO_DATA = Path(__file__).parent.joinpath('data', 'LEL2022_anonymous_rider_data.csv')
-TIME_FORMAT = '%d/%m/%Y %H:%M'
-
-CONTROL_DISTANCES = {
-    'Start': 0.0,
-    'StIvesNorthbound': 99.6,
-    'BostonNorthbound': 188.8,
-    'LouthNorthbound':  241.9,
-    'HessleNorthbound': 299.8,
-    'MaltonNorthbound': 366.7,
-    'BarnardCastle Northbound': 480.1,
-    'BramptonNorthbound': 563.5,
-    'MoffatNorthbound': 637.5,
-    'Dunfermline': 748.6,
-    'InnerleithenSouthbound': 829.9,
-    'EskdalemuirSouthbound': 879.2,
-    'BramptonSouthbound': 938.5,
-    'BarnardCastleSouthbound': 1022.1,
-    'MaltonSouthbound': 1133.9,
-    'HessleSouthbound': 1200.7,
-    'LouthSouthbound': 1259.1,
-    'BostonSouthbound': 1312.1,
-    'St IvesSouthbound': 1401.5,
-    'GreatEastonSouthbound': 1471.8,
-    'DebdenFinish': 1519.9,
-}
-
-CONTROLS = [k for k, v in sorted(CONTROL_DISTANCES.items(), key=lambda item: item[1])]
-
-def read_datetime(time):
-    try:
-        return datetime.strptime(time, TIME_FORMAT)
-    except ValueError:
-        return None
-
-
-def read_in_data():
-    with open(PATH_TO_DATA, 'r') as f:
-        # Each row is an OrderedDict, with the keys as the locations
-        # and the value as a datatime string.
-        rider_data = [row for row in csv.DictReader(f)]
-
-    # Remove the 'Start Location' key-value pair, as that is an exception
-    # to the rest of the data.
-    for row in rider_data:
-        del row['Start Location']
-
-    # Remove any control times which occur after a rider has a NULL value.
-    # There are weird disconnected lines which looks like riders have missed/skipped
-    # controls, which makes any graphs look messy. Assume that if a rider has a
-    # NULL value, they have DNFed from that control onwwards, and remove any
-    # subsequent times.
-    cleaned_rider_data = []
-    for rider in rider_data:
-        has_dnfed = False
-        for c in CONTROLS:
-            time = rider[c]
-
-            if time == 'NULL':
-                has_dnfed = True
-
-            if has_dnfed and time != 'NULL':
-                rider[c] = 'NULL'
-
-        cleaned_rider_data.append(rider)
-
-    return cleaned_rider_data
 
+from concurrent.futures import ProcessPoolExecutor
 
-def calculate_relative_times(rider_data):
-    # We want to analyse the times of each rider, relative to the start time.
-    # So convert each datetime string to a datetime object, and subtract the
-    # start time from each of the other times.
-    rider_times = []
+from instrument import stage
+from pace import pace_deviations
+from quantile_sketch import merge_sketches, new_sketch, sketch_counts, sketch_quantiles, update_sketch
+from rider_data import (
+    CONTROL_DISTANCES,
+    CONTROLS,
+    CUT_OFF_HOURS,
+    PATH_TO_DATA,
+    impute_skipped_times,
+    iter_rider_data,
+    load_rider_data,
+    remove_times_after_dnf,
+)
+from rider_db import query_rider_data
 
-    for row in rider_data:
+# Above this many riders the individual lines become a solid block of ink,
+# so draw a density image instead.
+DENSITY_THRESHOLD = 5000
 
-        # Convert the start time to a datetime object.
-        start_time = read_datetime(row['Start'])
+# The percentiles drawn in bands mode, paired off from the outside in.
+BAND_QUANTILES = [0.1, 0.25, 0.5, 0.75, 0.9]
 
-        if start_time is None:
-            continue
 
-        # Convert each of the other times to a datetime object, and subtract
-        # the start time from it.
-        relative_times = []
-        for c in CONTROLS:
-            time = read_datetime(row[c])
+def read_in_data(db_path=None):
+    # From the CSV, or from a database made by rider_db.export_sqlite.
+    if db_path:
+        rider_data, _ = query_rider_data(db_path)
 
-            if time is not None:
-                diff_hours = (time - start_time).total_seconds() / 3600
-                diff_hours = np.round(diff_hours, 2)
-            else:
-                diff_hours = None
+        return remove_times_after_dnf(rider_data)
 
-            relative_times.append(diff_hours)
+    rider_data, _ = load_rider_data(truncate_dnf=True)
 
-        rider_times.append(relative_times)
+    return rider_data
 
 
-    # We now want to calculate the times relative to the average pace
-    # required to finish with the 128 hour 20 min cut-off.
-    reference_speed = CONTROL_DISTANCES['DebdenFinish'] / 128.33
-    reference_times = [CONTROL_DISTANCES[loc] / reference_speed for loc in CONTROL_DISTANCES]
+def read_in_imputed_data(db_path=None):
+    # The same, but fill in isolated skipped controls before truncating at
+    # DNFs, so a single missed control doesn't end the rider's line. Also
+    # returns a mask of the imputed times.
+    if db_path:
+        rider_data, _ = query_rider_data(db_path)
+    else:
+        rider_data, _ = load_rider_data()
 
-    # Now subtract the reference times from the rider times.
-    for rider in rider_times:
-        for i, time in enumerate(rider):
-            if time is not None:
-                rider[i] = time - reference_times[i]
+    rider_data, imputed = impute_skipped_times(rider_data)
+    rider_data = remove_times_after_dnf(rider_data)
 
-    return rider_times
+    return rider_data, imputed & ~np.isnan(rider_data)
 
 
-def main():
-    rider_data = read_in_data()
+def calculate_relative_times(rider_data):
+    # We want to analyse the times of each rider, relative to the start time,
+    # and then relative to the average pace required to finish within the 128 hour 20 min cut-off.
+    # Skip any riders without a start time.
+    rider_data = rider_data[~np.isnan(rider_data[:, CONTROLS.index('Start')])]
 
-    rider_times = calculate_relative_times(rider_data)
+    return pace_deviations(rider_data, [CUT_OFF_HOURS])[:, :, 0]
 
-    # Sort riders according to the number of controls they reached.
-    rider_times = sorted(rider_times, key=lambda x: x.count(None))
 
-    # Plot each riders times on one graph.
-    locations = list(rider_data[0].keys())
-    locations = [loc.replace('Northbound', ' (N)') for loc in locations]
-    locations = [loc.replace('Southbound', ' (S)') for loc in locations]
+def sketch_relative_times(path=PATH_TO_DATA, chunk_size=100_000, impute=False):
+    # Stream a CSV through a quantile sketch of the relative times at each
+    # control, so that percentiles never need every rider in memory.
+    sketch = new_sketch(len(CONTROLS))
 
-    distances = list(CONTROL_DISTANCES.values())
+    with stage('sketch') as record:
+        for rider_data, _ in iter_rider_data(path, chunk_size=chunk_size):
+            if impute:
+                rider_data, _ = impute_skipped_times(rider_data)
 
-    # Get min/max final times
-    time_max = np.max([r[-1] for r in rider_times if r[-1] is not None])
-    time_min = np.min([r[-1] for r in rider_times if r[-1] is not None])
+            update_sketch(sketch, calculate_relative_times(remove_times_after_dnf(rider_data)))
 
-    for times in rider_times:
-        # Choose the colour based on the riders finish time and furthest control
-        max_control = len([t for t in times if t is not None])
-        normalised_max_control = max_control / len(times)
+        record['rows'] = int(sketch_counts(sketch)[0])
 
-        finish_time = np.min([t for t in times if t is not None])
-        normalised_finish_time = (finish_time - time_min) / (time_max - time_min)
+    return sketch
 
-        colour = (1 - normalised_max_control, 1 - normalised_finish_time, 0.5)
 
-        # Plot the line for this rider, as well as a marker
-        # for the final control they reached.
-        plt.plot(distances, times, color=colour)
+def sketch_files(paths, max_workers=None):
+    # Sketch several CSVs (e.g. an archive of editions on the same route)
+    # in parallel, one per worker process, and merge the results.
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        return merge_sketches(*executor.map(sketch_relative_times, paths))
 
-        # Find the last control they reached.
-        last_control = None
-        for i, time in enumerate(times):
-            if time is not None:
-                last_control = i
 
-        plt.plot(
-            distances[last_control],
-            times[last_control],
-            'X',
-            color=colour,
-            markersize=12,
-            markeredgewidth=1,
-            markeredgecolor='black',
-        )
+def main(density=None, bands=False, impute=False, output_path='rider_times.png', dpi=300, show=True, db_path=None):
+    # Only import matplotlib when actually plotting, it is slow to import.
+    import matplotlib.pyplot as plt
+    from rider_plots import plot_pace_bands, plot_rider_density, plot_rider_lines
+
+    locations = [loc.replace('Northbound', ' (N)') for loc in CONTROLS]
+    locations = [loc.replace('Southbound', ' (S)') for loc in locations]
+
+    distances = [CONTROL_DISTANCES[loc] for loc in CONTROLS]
+
+    if bands:
+        # Percentile bands from a sketch of the CSV, without loading it.
+        sketch = sketch_relative_times(impute=impute)
+        n_riders = sketch_counts(sketch)[0]
+
+        plot_pace_bands(distances, sketch_quantiles(sketch, BAND_QUANTILES), BAND_QUANTILES)
+    else:
+        if impute:
+            rider_data, imputed = read_in_imputed_data(db_path)
+        else:
+            rider_data = read_in_data(db_path)
+            imputed = np.zeros(rider_data.shape, dtype=bool)
+
+        rider_times = calculate_relative_times(rider_data)
+        imputed = imputed[~np.isnan(rider_data[:, CONTROLS.index('Start')])]
+        n_riders = len(rider_times)
+
+        # Sort riders according to the number of controls they reached.
+        order = np.argsort(np.isnan(rider_times).sum(axis=1), kind='stable')
+        rider_times = rider_times[order]
+        imputed = imputed[order]
+
+        if density is None:
+            density = len(rider_times) > DENSITY_THRESHOLD
+
+        if density:
+            plot_rider_density(distances, rider_times)
+        else:
+            # Get min/max final times
+            time_max = np.nanmax(rider_times[:, -1])
+            time_min = np.nanmin(rider_times[:, -1])
+
+            # Choose the colour based on the riders finish time and furthest control
+            max_control = np.sum(~np.isnan(rider_times), axis=1)
+            normalised_max_control = max_control / rider_times.shape[1]
+
+            finish_time = np.nanmin(rider_times, axis=1)
+            normalised_finish_time = (finish_time - time_min) / (time_max - time_min)
+
+            colours = np.column_stack([
+                1 - normalised_max_control,
+                1 - normalised_finish_time,
+                np.full(len(rider_times), 0.5),
+            ])
+
+            # Plot the line for each rider, as well as a marker
+            # for the final control they reached.
+            plot_rider_lines(distances, rider_times, colours, markersize=12, markeredgewidth=1)
+
+        # Mark the imputed times with hollow circles.
+        if np.any(imputed):
+            plt.scatter(
+                np.broadcast_to(distances, imputed.shape)[imputed],
+                rider_times[imputed],
+                s=30,
+                facecolors='white',
+                edgecolors='black',
+                linewidths=1,
+                label=f'Imputed times ({np.sum(imputed)})',
+                zorder=3,
+            )
+            plt.legend(loc='lower left', fontsize=14)
 
     # Add dashed black line to emphasise the 128 hour 20 min cut-off.
     plt.plot(distances, [0] * len(locations), 'k--', lw=2)
@@ -176,7 +165,7 @@ def main():
     plt.xticks(distances, labels=locations, rotation=45, ha='right', fontsize=18)
     plt.xlim([0, distances[-1] + 50])
     plt.ylabel('Time behind/ahead of 128 hour pace (hours)', fontsize=18)
-    plt.title(f'Rider control times relative to 128 hour pace (n = {len(rider_times)})', fontsize=24)
+    plt.title(f'Rider control times relative to 128 hour pace (n = {n_riders})', fontsize=24)
     plt.grid(b='on')
     plt.subplots_adjust(bottom=0.2, top=0.9)
 
@@ -188,9 +177,11 @@ def main():
     fig = plt.gcf()
     fig.set_size_inches(15, 12)
 
-    plt.savefig('rider_times.png', dpi=300)
+    with stage('render'):
+        plt.savefig(output_path, dpi=dpi)
 
-    plt.show()
+    if show:
+        plt.show()
 
 
 
@@ -0,0 +1,270 @@
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import resource
+import shutil
+import time
+
+from pathlib import Path
+
+from rider_data import PATH_TO_CACHE
+
+PATH_TO_SYNTHETIC_DATA = PATH_TO_CACHE.joinpath('synthetic')
+PATH_TO_BASELINE = PATH_TO_CACHE.joinpath('benchmark_baseline.json')
+
+DEFAULT_SIZES = [1_000, 10_000, 100_000, 1_000_000]
+
+# A stage has regressed if it is this much slower than the baseline (and
+# slower by more than MIN_REGRESSION_SECONDS, to ignore timer noise).
+REGRESSION_TOLERANCE = 0.25
+MIN_REGRESSION_SECONDS = 0.05
+
+# Drawing one line per rider is only benchmarked up to this many riders.
+MAX_LINE_PLOT_RIDERS = 100_000
+
+
+# Each stage has a setup function, which isn't timed, and returns the
+# arguments for the timed function.
+
+def setup_path(path):
+    return (path,)
+
+
+def setup_cached(path):
+    from rider_data import load_rider_data
+
+    return (load_rider_data(path)[0],)
+
+
+def setup_truncated(path):
+    from rider_data import load_rider_data
+
+    return (load_rider_data(path, truncate_dnf=True)[0],)
+
+
+def setup_relative_times(path):
+    from analyse_times import calculate_relative_times
+    from rider_data import load_rider_data
+
+    return (calculate_relative_times(load_rider_data(path, truncate_dnf=True)[0]),)
+
+
+def run_parse(path):
+    from rider_data import parse_rider_data
+
+    parse_rider_data(path)
+
+
+def run_build_cache(path):
+    from rider_data import load_rider_data
+
+    load_rider_data(path)
+
+
+def run_load_cached(path):
+    from rider_data import load_rider_data
+
+    # Touch every value, so that the memory-mapped matrix is actually read.
+    load_rider_data(path)[0].sum()
+
+
+def run_stream(path):
+    from analyse_stream import summarise
+
+    summarise(path)
+
+
+def run_truncate_dnf(rider_data):
+    from rider_data import remove_times_after_dnf
+
+    remove_times_after_dnf(rider_data)
+
+
+def run_relative_times(rider_data):
+    from analyse_times import calculate_relative_times
+
+    calculate_relative_times(rider_data)
+
+
+def run_finish_times(rider_data):
+    from analyse_finishes import calculate_finish_times
+
+    calculate_finish_times(rider_data)
+
+
+def run_overtaking(rider_data):
+    from analyse_overtaking import calculate_overtaking
+
+    calculate_overtaking(rider_data)
+
+
+def run_occupancy(rider_data):
+    from analyse_occupancy import calculate_occupancy
+
+    calculate_occupancy(rider_data)
+
+
+def run_plot(rider_times, density):
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    from rider_data import CONTROL_DISTANCES, CONTROLS
+    from rider_plots import plot_rider_density, plot_rider_lines
+
+    distances = [CONTROL_DISTANCES[loc] for loc in CONTROLS]
+
+    if density:
+        plot_rider_density(distances, rider_times)
+    else:
+        plot_rider_lines(distances, rider_times, 'tab:blue')
+
+    plt.savefig(io.BytesIO(), format='png', dpi=100)
+    plt.close('all')
+
+
+def run_plot_lines(rider_times):
+    run_plot(rider_times, density=False)
+
+
+def run_plot_density(rider_times):
+    run_plot(rider_times, density=True)
+
+
+STAGES = {
+    'parse': (setup_path, run_parse),
+    'build_cache': (setup_path, run_build_cache),
+    'load_cached': (setup_path, run_load_cached),
+    'stream': (setup_path, run_stream),
+    'truncate_dnf': (setup_cached, run_truncate_dnf),
+    'relative_times': (setup_truncated, run_relative_times),
+    'finish_times': (setup_cached, run_finish_times),
+    'overtaking': (setup_truncated, run_overtaking),
+    'occupancy': (setup_truncated, run_occupancy),
+    'plot_lines': (setup_relative_times, run_plot_lines),
+    'plot_density': (setup_relative_times, run_plot_density),
+}
+
+
+def run_stage(stage, path):
+    # Runs in a fresh child process, so that the peak RSS it reports belongs
+    # to this stage alone (plus the interpreter and its imports).
+    setup, run = STAGES[stage]
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        args = setup(path)
+
+        start = time.perf_counter()
+        run(*args)
+        seconds = time.perf_counter() - start
+
+    # ru_maxrss is in kilobytes on Linux.
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+    return seconds, peak_rss_mb
+
+
+def synthetic_data(n_riders):
+    from generate_data import generate_data
+
+    PATH_TO_SYNTHETIC_DATA.mkdir(parents=True, exist_ok=True)
+
+    path = PATH_TO_SYNTHETIC_DATA.joinpath(f'riders_{n_riders}.csv')
+    if not path.exists():
+        generate_data(path, n_riders)
+
+    return path
+
+
+def benchmark(sizes, stages):
+    results = []
+
+    for n_riders in sizes:
+        path = synthetic_data(n_riders)
+
+        # Start each size from a cold cache.
+        for cache_dir in PATH_TO_CACHE.glob(f'{path.stem}-*'):
+            shutil.rmtree(cache_dir)
+
+        for stage in stages:
+            if stage == 'plot_lines' and n_riders > MAX_LINE_PLOT_RIDERS:
+                continue
+
+            with multiprocessing.get_context('fork').Pool(1) as pool:
+                seconds, peak_rss_mb = pool.apply(run_stage, (stage, path))
+
+            result = {
+                'n_riders': n_riders,
+                'stage': stage,
+                'seconds': seconds,
+                'riders_per_second': n_riders / seconds if seconds > 0 else float('inf'),
+                'peak_rss_mb': peak_rss_mb,
+            }
+            results.append(result)
+
+            print(
+                f'{n_riders:>10} {stage:<15} {seconds:>9.3f} s '
+                f'{result["riders_per_second"]:>14,.0f} riders/s {peak_rss_mb:>9.1f} MB'
+            )
+
+    return results
+
+
+def find_regressions(results, baseline):
+    baseline = {(r['n_riders'], r['stage']): r['seconds'] for r in baseline}
+
+    regressions = []
+    for r in results:
+        previous = baseline.get((r['n_riders'], r['stage']))
+        if previous is None:
+            continue
+
+        if r['seconds'] > previous * (1 + REGRESSION_TOLERANCE) and r['seconds'] - previous > MIN_REGRESSION_SECONDS:
+            regressions.append((r, previous))
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Time each stage of the analysis on synthetic data.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES)
+    parser.add_argument('--stages', nargs='+', choices=list(STAGES), default=list(STAGES))
+    parser.add_argument('--output', help='Write the results to this JSON file.')
+    parser.add_argument('--baseline', default=PATH_TO_BASELINE, help='Baseline JSON file to compare against.')
+    parser.add_argument('--save-baseline', action='store_true', help='Save these results as the new baseline.')
+    args = parser.parse_args()
+
+    results = benchmark(args.sizes, args.stages)
+
+    if args.output:
+        Path(args.output).write_text(json.dumps(results, indent=2))
+
+    baseline_path = Path(args.baseline)
+
+    if args.save_baseline:
+        baseline_path.parent.mkdir(parents=True, exist_ok=True)
+        baseline_path.write_text(json.dumps(results, indent=2))
+        print(f'\nSaved baseline to {baseline_path}')
+        return
+
+    if not baseline_path.exists():
+        return
+
+    regressions = find_regressions(results, json.loads(baseline_path.read_text()))
+
+    if not regressions:
+        print('\nNo regressions against the baseline.')
+        return
+
+    print('\nRegressions against the baseline:')
+    for r, previous in regressions:
+        print(f'{r["n_riders"]:>10} {r["stage"]:<15} {previous:.3f} s -> {r["seconds"]:.3f} s')
+
+    raise SystemExit(1)
+
+
+
+if __name__ == '__main__':
+    main()
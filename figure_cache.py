@@ -0,0 +1,128 @@
+import ast
+import hashlib
+import json
+import os
+import shutil
+import time
+
+from pathlib import Path
+
+from rider_data import PATH_TO_CACHE, PATH_TO_DATA, cache_key
+
+PATH_TO_FIGURE_CACHE = PATH_TO_CACHE.joinpath('figures')
+
+PATH_TO_CODE = Path(__file__).parent
+
+# The scripts which draw the figures. A change to any of them, or to any of
+# this repo's modules they import (directly or not), invalidates every
+# cached figure.
+FIGURE_MODULES = ['analyse_fast_riders', 'analyse_finishes', 'analyse_my_times', 'analyse_times']
+
+# Anything else the figures depend on which isn't a module.
+DATA_FILES = ['routes/lel2022.json']
+
+
+def imported_modules(path):
+    # The names of the modules imported anywhere in a source file, including
+    # inside functions, as matplotlib and friends are imported lazily.
+    modules = set()
+    for node in ast.walk(ast.parse(path.read_text())):
+        if isinstance(node, ast.Import):
+            modules.update(alias.name.split('.')[0] for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+            modules.add(node.module.split('.')[0])
+
+    return modules
+
+
+def code_files(modules=FIGURE_MODULES):
+    # The source files of the modules and of every module in this repo they
+    # import, followed recursively, so the list can't drift from the code.
+    found = set()
+    to_visit = list(modules)
+
+    while to_visit:
+        path = PATH_TO_CODE.joinpath(f'{to_visit.pop()}.py')
+        if path in found or not path.exists():
+            continue
+
+        found.add(path)
+        to_visit += imported_modules(path)
+
+    return sorted(path.name for path in found) + DATA_FILES
+
+
+MAX_CACHE_BYTES = 500 * 1024 ** 2
+MAX_CACHE_AGE_DAYS = 30
+
+
+def code_version():
+    h = hashlib.sha256()
+    for name in code_files():
+        h.update(PATH_TO_CODE.joinpath(name).read_bytes())
+
+    return h.hexdigest()
+
+
+def figure_key(name, params, path=PATH_TO_DATA):
+    # Key a figure on the dataset, the parameters it was drawn with and the
+    # code that drew it. Anything hardcoded in the scripts (reference pace,
+    # histogram bins, filters) is covered by the code version.
+    key = {
+        'name': name,
+        'data': cache_key(path),
+        'params': params,
+        'code': code_version(),
+    }
+
+    return hashlib.sha256(json.dumps(key, sort_keys=True, default=str).encode()).hexdigest()[:32]
+
+
+def fetch_figure(key, output_path):
+    # Copy a cached figure to output_path, returning False if there isn't one.
+    cached_path = PATH_TO_FIGURE_CACHE.joinpath(f'{key}.png')
+    if not cached_path.exists():
+        return False
+
+    shutil.copyfile(cached_path, output_path)
+
+    # Touch the cached file, so that eviction removes the least recently
+    # used figures first.
+    os.utime(cached_path)
+
+    return True
+
+
+def store_figure(key, output_path):
+    PATH_TO_FIGURE_CACHE.mkdir(parents=True, exist_ok=True)
+
+    tmp_path = PATH_TO_FIGURE_CACHE.joinpath(f'{key}.png.tmp')
+    shutil.copyfile(output_path, tmp_path)
+    tmp_path.replace(PATH_TO_FIGURE_CACHE.joinpath(f'{key}.png'))
+
+    evict_figures()
+
+
+def evict_figures(max_bytes=MAX_CACHE_BYTES, max_age_days=MAX_CACHE_AGE_DAYS):
+    # Remove figures which haven't been used for max_age_days, then remove
+    # the least recently used figures until the cache fits in max_bytes.
+    if not PATH_TO_FIGURE_CACHE.exists():
+        return
+
+    oldest = time.time() - max_age_days * 24 * 3600
+
+    entries = []
+    for path in PATH_TO_FIGURE_CACHE.glob('*.png'):
+        stat = path.stat()
+        if stat.st_mtime < oldest:
+            path.unlink()
+        else:
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+
+        path.unlink()
+        total -= size
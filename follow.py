@@ -0,0 +1,255 @@
+import argparse
+import sys
+import time
+import numpy as np
+
+from analyse_stream import FINISH_TIME_BINS
+from instrument import instrumented
+from pace import pace_deviations
+from rider_data import CONTROLS, CUT_OFF_HOURS, parse_times
+
+# The live feed is an append-only log of arrivals, one per line:
+#
+#   Rider,Control,Time
+#   17,StIvesNorthbound,07/08/2022 10:12
+#
+# where Rider is a row number in the time matrix and Time may be NULL to
+# clear a time. A later line for the same rider and control replaces the
+# earlier time, so corrections are just appended too.
+HEADER = 'Rider,Control,Time'
+
+CONTROL_INDEX = {c: i for i, c in enumerate(CONTROLS)}
+
+# Rider numbers are rows of the time matrix, which grows to fit the largest
+# one, so anything at or above this is treated as a bad line rather than
+# allocating a huge matrix. A million riders is about 170 MB per matrix.
+MAX_RIDERS = 1_000_000
+
+
+def finish_bins(rider_data):
+    # The finish histogram bin of each rider, or -1 if they haven't finished
+    # (or have no start time, or are outside the histogram).
+    finish_times = np.round((rider_data[:, -1] - rider_data[:, 0]) / 60, 2)
+
+    bins = np.searchsorted(FINISH_TIME_BINS, finish_times, side='right') - 1
+    bins[finish_times == FINISH_TIME_BINS[-1]] = len(FINISH_TIME_BINS) - 2
+
+    inside = (bins >= 0) & (bins < len(FINISH_TIME_BINS) - 1)
+
+    return np.where(inside, bins, -1)
+
+
+def new_follow_state(path, rider_data=None):
+    # The state of a followed arrivals file: how far it has been read, the
+    # time matrix so far (which grows by doubling as riders appear) and the
+    # aggregates, which are kept up to date one arrival at a time. An
+    # existing time matrix, e.g. from a start list, can be the starting
+    # point.
+    n_controls = len(CONTROLS)
+
+    if rider_data is None:
+        rider_data = np.empty((0, n_controls))
+
+    n_riders = len(rider_data)
+    capacity = max(1024, n_riders)
+
+    times = np.full((capacity, n_controls), np.nan)
+    times[:n_riders] = rider_data
+
+    pace = np.full((capacity, n_controls), np.nan)
+    pace[:n_riders] = pace_deviations(rider_data, [CUT_OFF_HOURS])[:, :, 0]
+
+    bins = finish_bins(rider_data)
+
+    return {
+        'path': path,
+        'offset': 0,
+        'n_riders': n_riders,
+        'times': times,
+        'pace': pace,
+        'control_counts': np.sum(~np.isnan(rider_data), axis=0),
+        'finish_counts': np.bincount(bins[bins >= 0], minlength=len(FINISH_TIME_BINS) - 1),
+    }
+
+
+def read_new_lines(state):
+    # Read whatever has been appended since the last refresh, returning the
+    # lines and the offset just after them. Only complete lines are read, so
+    # a line which is still being written is picked up whole next time. The
+    # offset isn't moved on here, so nothing is lost if parsing fails.
+    with open(state['path'], 'rb') as f:
+        f.seek(state['offset'])
+        data = f.read()
+
+    end = data.rfind(b'\n') + 1
+    lines = data[:end].decode('utf-8').splitlines()
+
+    return [line for line in lines if line and line != HEADER], state['offset'] + end
+
+
+def parse_arrivals(lines):
+    # Parse arrival lines into rider numbers, control columns and times
+    # (NaN for NULL). The text is split into fields in one go, rather than
+    # line by line, so catching up with a long file is quick too. Lines
+    # without three fields, a non-negative integer rider below MAX_RIDERS, a
+    # known control and a valid time (or NULL) are left out and returned as
+    # bad lines.
+    well_formed = [line.count(',') == 2 for line in lines]
+    good_lines = [line for line, ok in zip(lines, well_formed) if ok]
+
+    fields = ','.join(good_lines).split(',') if good_lines else []
+    rider_fields, control_fields = fields[0::3], fields[1::3]
+    time_fields = np.array(fields[2::3], dtype=str)
+
+    minutes = parse_times(time_fields)
+    valid = np.array(
+        [
+            r.isascii() and r.isdigit() and int(r) < MAX_RIDERS and c in CONTROL_INDEX
+            for r, c in zip(rider_fields, control_fields)
+        ],
+        dtype=bool,
+    )
+    valid &= ~np.isnan(minutes) | (time_fields == 'NULL')
+
+    riders = np.fromiter(
+        (int(r) if ok else 0 for r, ok in zip(rider_fields, valid)), dtype=np.int64, count=len(good_lines)
+    )
+    controls = np.fromiter(
+        (CONTROL_INDEX[c] if ok else 0 for c, ok in zip(control_fields, valid)), dtype=np.int64, count=len(good_lines)
+    )
+
+    bad_lines = [line for line, ok in zip(lines, well_formed) if not ok]
+    bad_lines += [line for line, ok in zip(good_lines, valid) if not ok]
+
+    return riders[valid], controls[valid], minutes[valid], bad_lines
+
+
+def grow(state, n_riders):
+    # Make room for at least n_riders rows.
+    capacity = len(state['times'])
+    if n_riders <= capacity:
+        return
+
+    while capacity < n_riders:
+        capacity *= 2
+
+    for name in ['times', 'pace']:
+        grown = np.full((capacity, len(CONTROLS)), np.nan)
+        grown[:len(state[name])] = state[name]
+        state[name] = grown
+
+
+@instrumented('follow_refresh')
+def apply_arrivals(state, riders, controls, minutes):
+    # Write a batch of arrivals into the time matrix and update the
+    # aggregates for just the cells and riders they touch, so the cost
+    # depends on the size of the batch, not on the number of riders.
+    if not len(riders):
+        return riders
+
+    # Only the last arrival for each cell in the batch counts.
+    keys = riders * len(CONTROLS) + controls
+    _, last = np.unique(keys[::-1], return_index=True)
+    last = len(keys) - 1 - last
+    riders, controls, minutes = riders[last], controls[last], minutes[last]
+
+    # Clearing a time of a rider who isn't in the matrix yet changes
+    # nothing, and shouldn't grow the matrix.
+    keep = ~np.isnan(minutes) | (riders < state['n_riders'])
+    riders, controls, minutes = riders[keep], controls[keep], minutes[keep]
+    if not len(riders):
+        return riders
+
+    grow(state, riders.max() + 1)
+    state['n_riders'] = max(state['n_riders'], riders.max() + 1)
+
+    times = state['times']
+
+    # Per-control counts: +1 for each newly filled cell, -1 for each cleared.
+    old = times[riders, controls]
+    filled = np.isnan(old) & ~np.isnan(minutes)
+    cleared = ~np.isnan(old) & np.isnan(minutes)
+    state['control_counts'] = (
+        state['control_counts']
+        + np.bincount(controls[filled], minlength=len(CONTROLS))
+        - np.bincount(controls[cleared], minlength=len(CONTROLS))
+    )
+
+    # Finish histogram: take the touched riders out, update, put them back.
+    touched = np.unique(riders)
+
+    old_bins = finish_bins(times[touched])
+    state['finish_counts'] -= np.bincount(old_bins[old_bins >= 0], minlength=len(FINISH_TIME_BINS) - 1)
+
+    times[riders, controls] = minutes
+
+    new_bins = finish_bins(times[touched])
+    state['finish_counts'] += np.bincount(new_bins[new_bins >= 0], minlength=len(FINISH_TIME_BINS) - 1)
+
+    # Pace deviations of the touched riders (a whole row, as a new start
+    # time moves every control).
+    state['pace'][touched] = pace_deviations(times[touched], [CUT_OFF_HOURS])[:, :, 0]
+
+    return riders
+
+
+def refresh(state):
+    # Parse and apply any new arrivals, returning how many were applied and
+    # the lines which couldn't be parsed (which are skipped).
+    lines, end = read_new_lines(state)
+
+    riders, controls, minutes, bad_lines = parse_arrivals(lines)
+    apply_arrivals(state, riders, controls, minutes)
+
+    state['offset'] = end
+
+    return len(riders), bad_lines
+
+
+def rider_times(state):
+    # The current time matrix (a view, without the spare capacity).
+    return state['times'][:state['n_riders']]
+
+
+def follow(path, interval=5.0):
+    # Refresh every interval seconds until interrupted, printing a line
+    # whenever there are new arrivals.
+    state = new_follow_state(path)
+
+    try:
+        while True:
+            start = time.perf_counter()
+            n_arrivals, bad_lines = refresh(state)
+            seconds = time.perf_counter() - start
+
+            for line in bad_lines:
+                print(f'Skipped bad line: {line!r}', file=sys.stderr)
+
+            if n_arrivals:
+                finishers = state['finish_counts'].sum()
+                furthest = np.flatnonzero(state['control_counts'])
+                furthest = CONTROLS[furthest[-1]] if len(furthest) else '-'
+                print(
+                    f'{n_arrivals} new arrivals in {seconds * 1000:.1f} ms: '
+                    f'{state["n_riders"]} riders, {finishers} finishers, furthest control {furthest}'
+                )
+
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        pass
+
+    return state
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Follow a growing arrivals file and keep the summaries up to date.')
+    parser.add_argument('path')
+    parser.add_argument('--interval', type=float, default=5.0, help='Seconds between refreshes.')
+    args = parser.parse_args()
+
+    follow(args.path, args.interval)
+
+
+
+if __name__ == '__main__':
+    main()
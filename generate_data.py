@@ -0,0 +1,113 @@
+import argparse
+import numpy as np
+
+from rider_data import CONTROL_DISTANCES, CONTROLS, ROUTE, time_characters
+
+START_LOCATIONS = ['Debden', 'Guildhall', '']
+START_LOCATION_WEIGHTS = [0.888, 0.111, 0.001]
+
+# Roughly the proportions seen in the 2022 data.
+P_NO_START_TIME = 0.08
+P_DNF = 0.38
+P_SKIPPED_CONTROL = 0.04
+
+HEADER = ['Start', 'Start Location'] + CONTROLS[1:]
+
+
+def generate_riders(n_riders, rng):
+    # Generate a (riders x controls) matrix of synthetic control times, in
+    # minutes since the Unix epoch with NaN for NULL, plus start locations.
+    distances = np.array([CONTROL_DISTANCES[loc] for loc in CONTROLS])
+    stage_distances = np.diff(distances)
+
+    # Start time and location.
+    start_times = rng.choice(ROUTE['start_waves'], size=n_riders)
+    start_locations = rng.choice(START_LOCATIONS, size=n_riders, p=START_LOCATION_WEIGHTS)
+
+    # Each rider has an overall target time, spread around the 2022 finish
+    # times, and the stages are ridden at that pace with some noise.
+    finish_hours = np.clip(rng.normal(118, 12, n_riders), 65, 140)
+    moving_hours = finish_hours * rng.uniform(0.7, 0.85, n_riders)
+    stage_minutes = 60 * moving_hours[:, None] * stage_distances / distances[-1]
+    stage_minutes *= rng.lognormal(0, 0.12, stage_minutes.shape)
+
+    # The rest of their time is spent sleeping, split across a few controls.
+    sleep_minutes = 60 * (finish_hours - moving_hours)
+    n_sleeps = rng.integers(2, 5, n_riders)
+    sleep_weights = rng.random(stage_minutes.shape)
+    # Keep only each rider's n_sleeps largest weights, by their rank.
+    sleep_ranks = sleep_weights.argsort(axis=1).argsort(axis=1)
+    sleep_weights[sleep_ranks < stage_minutes.shape[1] - n_sleeps[:, None]] = 0
+    stage_minutes += sleep_minutes[:, None] * sleep_weights / sleep_weights.sum(axis=1, keepdims=True)
+
+    times = np.column_stack([start_times, start_times[:, None] + np.cumsum(stage_minutes, axis=1)])
+    times = np.round(times)
+
+    # DNFs: no times from some control onwards.
+    dnf = rng.random(n_riders) < P_DNF
+    dnf_control = rng.integers(1, len(CONTROLS), n_riders)
+    times[dnf[:, None] & (np.arange(len(CONTROLS)) >= dnf_control[:, None])] = np.nan
+
+    # Isolated missed controls, with later controls still recorded.
+    skipped = rng.random(n_riders) < P_SKIPPED_CONTROL
+    skipped_control = rng.integers(1, len(CONTROLS) - 1, n_riders)
+    times[skipped, skipped_control[skipped]] = np.nan
+
+    # Riders whose start was never recorded.
+    times[rng.random(n_riders) < P_NO_START_TIME, 0] = np.nan
+
+    return times, start_locations
+
+
+def format_rows(times, start_locations):
+    # Build the CSV text for a chunk of riders without a Python loop. Every
+    # field is laid out in a fixed-width byte slot, padded with zero bytes
+    # (which is how numpy pads bytes strings), and then the padding is
+    # dropped from the whole buffer in one go.
+    n_riders = len(times)
+
+    time_chars = time_characters(times, dtype=np.uint8).reshape(n_riders, times.shape[1], 16)
+    location_chars = np.char.encode(start_locations).view(np.uint8).reshape(n_riders, -1)
+
+    columns = [time_chars[:, 0], location_chars] + [time_chars[:, c] for c in range(1, times.shape[1])]
+
+    comma = np.full((n_riders, 1), ord(','), dtype=np.uint8)
+    newline = np.tile(np.frombuffer(b'\r\n', dtype=np.uint8), (n_riders, 1))
+
+    slots = []
+    for column in columns:
+        slots += [column, comma]
+    slots[-1] = newline
+
+    buffer = np.hstack(slots).reshape(-1)
+
+    return buffer[buffer != 0].tobytes()
+
+
+def generate_data(path, n_riders, seed=0, chunk_size=100_000):
+    # Write a synthetic rider file with the same layout as the 2022 data,
+    # generating it a chunk at a time so memory use doesn't depend on the
+    # number of riders.
+    rng = np.random.default_rng(seed)
+
+    with open(path, 'wb') as f:
+        f.write((','.join(HEADER) + '\r\n').encode())
+
+        for i in range(0, n_riders, chunk_size):
+            times, start_locations = generate_riders(min(chunk_size, n_riders - i), rng)
+            f.write(format_rows(times, start_locations))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate synthetic LEL rider data.')
+    parser.add_argument('path')
+    parser.add_argument('n_riders', type=int)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    generate_data(args.path, args.n_riders, seed=args.seed)
+
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,162 @@
+import atexit
+import functools
+import json
+import os
+import resource
+import time
+import tracemalloc
+
+from contextlib import contextmanager
+
+# Instrumentation is off unless enable() is called, or LEL_PROFILE (path of
+# the JSON report) or LEL_TRACE (path of a Chrome trace file) is set. When it
+# is off each instrumented call only costs one extra function call and a
+# flag check.
+ENABLED = False
+
+RECORDS = []
+STACK = []
+
+START = time.perf_counter()
+
+
+def enable():
+    global ENABLED
+
+    if ENABLED:
+        return
+
+    ENABLED = True
+
+    # numpy reports its array allocations to tracemalloc, so this tracks
+    # the memory used by the time matrix as well as by Python objects.
+    if not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+
+@contextmanager
+def stage(name):
+    # Record the wall time, CPU time and peak traced memory of a block of
+    # code. The record is yielded so the block can fill in 'rows'.
+    if not ENABLED:
+        yield {}
+        return
+
+    # Keep the parent's peak before resetting it for this stage.
+    if STACK:
+        STACK[-1]['peak_memory_mb'] = max(STACK[-1]['peak_memory_mb'], tracemalloc.get_traced_memory()[1] / 1024 ** 2)
+    tracemalloc.reset_peak()
+
+    record = {
+        'name': name,
+        'depth': len(STACK),
+        'rows': None,
+        'start': time.perf_counter() - START,
+        'start_memory_mb': tracemalloc.get_traced_memory()[0] / 1024 ** 2,
+        'peak_memory_mb': 0.0,
+    }
+    STACK.append(record)
+
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+
+    try:
+        yield record
+    finally:
+        record['wall_seconds'] = time.perf_counter() - wall_start
+        record['cpu_seconds'] = time.process_time() - cpu_start
+        record['peak_memory_mb'] = max(record['peak_memory_mb'], tracemalloc.get_traced_memory()[1] / 1024 ** 2)
+
+        STACK.pop()
+        RECORDS.append(record)
+
+
+def count_rows(result):
+    # By default, the number of rows is the length of the result, or of its
+    # first element for functions returning a tuple (e.g. times, locations).
+    if isinstance(result, tuple) and result:
+        result = result[0]
+
+    try:
+        return len(result)
+    except TypeError:
+        return None
+
+
+def instrumented(name, rows=count_rows):
+    # Decorator which records every call of a function as a stage.
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not ENABLED:
+                return func(*args, **kwargs)
+
+            with stage(name) as record:
+                result = func(*args, **kwargs)
+                record['rows'] = rows(result)
+
+            return result
+
+        return wrapper
+
+    return decorator
+
+
+def report():
+    return {
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        'stages': sorted(RECORDS, key=lambda r: r['start']),
+    }
+
+
+def write_report(path):
+    with open(path, 'w') as f:
+        json.dump(report(), f, indent=2)
+
+
+def write_chrome_trace(path):
+    # Complete ('X') events, which chrome://tracing and Perfetto can open.
+    events = [
+        {
+            'name': r['name'],
+            'ph': 'X',
+            'ts': r['start'] * 1e6,
+            'dur': r['wall_seconds'] * 1e6,
+            'pid': os.getpid(),
+            'tid': 0,
+            'args': {
+                'cpu_seconds': r['cpu_seconds'],
+                'start_memory_mb': r['start_memory_mb'],
+                'peak_memory_mb': r['peak_memory_mb'],
+                'rows': r['rows'],
+            },
+        }
+        for r in RECORDS
+    ]
+
+    with open(path, 'w') as f:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+
+
+def print_report():
+    # The memory column is how far the peak rose above the memory already in
+    # use when the stage started.
+    print(f'{"Stage":<30} {"Rows":>10} {"Wall (s)":>9} {"CPU (s)":>9} {"Peak +MB":>9}')
+    for r in report()['stages']:
+        name = '  ' * r['depth'] + r['name']
+        rows = '' if r['rows'] is None else r['rows']
+        increase = r['peak_memory_mb'] - r['start_memory_mb']
+        print(f'{name:<30} {rows:>10} {r["wall_seconds"]:>9.3f} {r["cpu_seconds"]:>9.3f} {increase:>9.1f}')
+
+
+def write_on_exit(report_path=None, trace_path=None):
+    enable()
+
+    if report_path:
+        atexit.register(write_report, report_path)
+    if trace_path:
+        atexit.register(write_chrome_trace, trace_path)
+
+
+if os.environ.get('LEL_PROFILE') or os.environ.get('LEL_TRACE'):
+    write_on_exit(os.environ.get('LEL_PROFILE'), os.environ.get('LEL_TRACE'))
@@ -0,0 +1,34 @@
+import numpy as np
+
+from instrument import instrumented
+from rider_data import ROUTE
+
+
+def elapsed_hours(rider_data):
+    # Hours since each rider's start at every control (to the nearest 0.01
+    # hours). Missing times, or a missing start time, give NaN. The columns
+    # are in route order, so the start is always the first one.
+    start_times = rider_data[:, [0]]
+
+    return np.round((rider_data - start_times) / 60, 2)
+
+
+def reference_times(targets, route=ROUTE):
+    # The time to reach each control when riding at the average pace needed
+    # to finish in each target number of hours, as a (controls x targets)
+    # array.
+    targets = np.atleast_1d(np.asarray(targets, dtype=float))
+
+    distances = np.array([route['control_distances'][loc] for loc in route['controls']])
+    reference_speeds = distances[-1] / targets
+
+    return distances[:, None] / reference_speeds[None, :]
+
+
+@instrumented('relative_times')
+def pace_deviations(rider_data, targets, route=ROUTE):
+    # How far each rider is behind (positive) or ahead (negative) of the
+    # pace needed to finish in each of the target times, in hours. The
+    # elapsed times are only calculated once and then broadcast against
+    # every target, giving a (riders x controls x targets) array.
+    return elapsed_hours(rider_data)[:, :, None] - reference_times(targets, route)[None, :, :]
@@ -0,0 +1,201 @@
+import sys
+import numpy as np
+
+from pathlib import Path
+
+from instrument import instrumented
+from pace import elapsed_hours
+from rider_data import (
+    CONTROL_DISTANCES,
+    CONTROLS,
+    CUT_OFF_HOURS,
+    PATH_TO_CACHE,
+    PATH_TO_DATA,
+    cache_key,
+    impute_skipped_times,
+    load_rider_data,
+)
+
+PATH_TO_MODELS = PATH_TO_CACHE.joinpath('models')
+
+# Bump this whenever the way the model is fitted changes.
+MODEL_VERSION = 1
+
+# Regularisation of the least squares fits, which keeps the long prefixes
+# (with 20 correlated features) stable.
+RIDGE = 1.0
+
+# Riders who reached each control are split into this many equal-sized bins
+# by how long they took to get there, and the cut-off risk is the fraction
+# of each bin who didn't finish in time.
+N_RISK_BINS = 10
+
+
+def last_controls(rider_data):
+    # The last control each rider reached (-1 for riders with no times).
+    reached = ~np.isnan(rider_data)
+    last = rider_data.shape[1] - 1 - np.argmax(reached[:, ::-1], axis=1)
+
+    return np.where(reached.any(axis=1), last, -1)
+
+
+def prefix_features(rider_data, last):
+    # The features for each rider, given the last control they reached: the
+    # hours since their start at every control up to that one, and zero
+    # after it. Isolated skipped controls are imputed, and any other gaps
+    # are filled by assuming an even pace up to the last control.
+    distances = np.array([CONTROL_DISTANCES[loc] for loc in CONTROLS])
+
+    hours = elapsed_hours(impute_skipped_times(rider_data)[0])
+
+    rows = np.arange(len(rider_data))
+    last_hours = hours[rows, np.maximum(last, 0)]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        even_pace = last_hours[:, None] * distances / distances[np.maximum(last, 0), None]
+    hours = np.where(np.isnan(hours), even_pace, hours)
+
+    in_prefix = np.arange(len(CONTROLS)) <= last[:, None]
+
+    return np.where(in_prefix, hours, 0.0)
+
+
+@instrumented('train_predictor', rows=lambda result: None)
+def train_predictor(rider_data, cut_off_hours=CUT_OFF_HOURS):
+    # Fit one predictor for each "last control reached" prefix from a
+    # finished event's time matrix:
+    #   - a ridge regression of the finish time (hours) on the hours taken
+    #     to reach each control in the prefix, fitted on the finishers
+    #   - the spread of its errors
+    #   - for everyone who reached the last control of the prefix, the
+    #     fraction who didn't finish within the cut-off, by how long they
+    #     took to get there
+    # Everything is stored in arrays indexed by the prefix's last control.
+    n_controls = len(CONTROLS)
+
+    rider_data = rider_data[~np.isnan(rider_data[:, 0])]
+    finish_hours = elapsed_hours(rider_data)[:, -1]
+    finished = ~np.isnan(finish_hours)
+    in_time = finished & (finish_hours < cut_off_hours)
+
+    # Whether each rider has a time (recorded or imputed) at each control.
+    has_time = ~np.isnan(impute_skipped_times(rider_data)[0])
+
+    coefficients = np.zeros((n_controls, n_controls + 1))
+    residual_std = np.full(n_controls, np.nan)
+    risk_edges = np.full((n_controls, N_RISK_BINS + 1), np.nan)
+    risk = np.full((n_controls, N_RISK_BINS), np.nan)
+
+    for c in range(n_controls):
+        # Regression on the finishers with a time at the prefix's last
+        # control.
+        fit = finished & has_time[:, c]
+
+        features = prefix_features(rider_data[fit], np.full(np.sum(fit), c))[:, :c + 1]
+        x = np.column_stack([np.ones(len(features)), features])
+        y = finish_hours[fit]
+
+        # Ridge regression as an ordinary least squares problem, with a row
+        # per penalised coefficient appended (the intercept isn't penalised).
+        # This avoids forming x.T @ x, which squares its condition number.
+        penalty = np.sqrt(RIDGE) * np.eye(x.shape[1])[1:]
+        x_ridge = np.vstack([x, penalty])
+        y_ridge = np.concatenate([y, np.zeros(len(penalty))])
+
+        coefficients[c, :c + 2] = np.linalg.lstsq(x_ridge, y_ridge, rcond=None)[0]
+        residual_std[c] = np.std(y - x @ coefficients[c, :c + 2])
+
+        # Cut-off risk for everyone who got this far.
+        reached = ~np.isnan(rider_data[:, c])
+        hours = elapsed_hours(rider_data[reached])[:, c]
+
+        edges = np.quantile(hours, np.linspace(0, 1, N_RISK_BINS + 1))
+        bins = np.clip(np.searchsorted(edges, hours, side='right') - 1, 0, N_RISK_BINS - 1)
+
+        n_bin = np.bincount(bins, minlength=N_RISK_BINS)
+        n_in_time = np.bincount(bins, weights=in_time[reached], minlength=N_RISK_BINS)
+
+        risk_edges[c] = edges
+        risk[c] = np.where(n_bin > 0, 1 - n_in_time / np.maximum(n_bin, 1), np.nan)
+
+    return {
+        'coefficients': coefficients,
+        'residual_std': residual_std,
+        'risk_edges': risk_edges,
+        'risk': risk,
+        'cut_off_hours': np.array(cut_off_hours),
+    }
+
+
+@instrumented('predict_finish')
+def predict_finish(model, rider_data):
+    # Score a batch of in-progress riders in one go. Returns each rider's
+    # predicted finish time (hours), the standard error of that prediction,
+    # and the risk (0 to 1) of not finishing within the cut-off, with NaN
+    # for riders without a start time.
+    last = last_controls(rider_data)
+    has_start = ~np.isnan(rider_data[:, 0])
+    last = np.where(has_start, last, 0)
+
+    features = np.column_stack([np.ones(len(rider_data)), prefix_features(rider_data, last)])
+
+    # Each rider's coefficients are those of their prefix, which are zero
+    # beyond its last control, so one row-wise dot product does every
+    # prefix at once.
+    predicted = np.einsum('ij,ij->i', features, model['coefficients'][last])
+    std_error = model['residual_std'][last]
+
+    hours = features[np.arange(len(rider_data)), last + 1]
+    edges = model['risk_edges'][last]
+    bins = np.clip(np.sum(hours[:, None] >= edges[:, 1:-1], axis=1), 0, N_RISK_BINS - 1)
+    risk = model['risk'][last, bins]
+
+    nan = np.where(has_start, 1.0, np.nan)
+
+    return predicted * nan, std_error * nan, risk * nan
+
+
+def load_predictor(path=PATH_TO_DATA, use_cache=True):
+    # The predictor trained on a finished event's data, from the cache on
+    # disk if it has been trained before, so that scoring starts instantly.
+    path = Path(path)
+    model_path = PATH_TO_MODELS.joinpath(f'{path.stem}-{cache_key(path)}-v{MODEL_VERSION}.npz')
+
+    if use_cache and model_path.exists():
+        with np.load(model_path) as f:
+            return dict(f)
+
+    rider_data, _ = load_rider_data(path)
+    model = train_predictor(rider_data)
+
+    if use_cache:
+        PATH_TO_MODELS.mkdir(parents=True, exist_ok=True)
+        tmp_path = model_path.with_name(model_path.stem + '.tmp.npz')
+        np.savez(tmp_path, **model)
+        tmp_path.rename(model_path)
+
+    return model
+
+
+def main():
+    # Train on the 2022 data (or a given CSV), then check how well it does
+    # by cutting every finisher off after each control in turn.
+    path = sys.argv[1] if len(sys.argv) > 1 else PATH_TO_DATA
+
+    model = load_predictor(path)
+
+    rider_data, _ = load_rider_data(path)
+    rider_data = rider_data[~np.isnan(rider_data[:, 0]) & ~np.isnan(rider_data[:, -1])]
+    finish_hours = elapsed_hours(rider_data)[:, -1]
+
+    print(f'{"Last control":<26} {"Mean abs error (h)":>19} {"Mean risk":>10}')
+    for c in range(len(CONTROLS) - 1):
+        partial = rider_data.copy()
+        partial[:, c + 1:] = np.nan
+
+        predicted, _, risk = predict_finish(model, partial)
+        print(f'{CONTROLS[c]:<26} {np.mean(np.abs(predicted - finish_hours)):>19.2f} {np.mean(risk):>10.2f}')
+
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+import numpy as np
+
+# Each level of a sketch holds at most this many values. The rank error of a
+# quantile is roughly log2(n / k) / k, so with 256 it's well under 1% even for
+# millions of values, while each column only keeps a few thousand values.
+DEFAULT_CAPACITY = 256
+
+
+def new_sketch(n_columns, k=DEFAULT_CAPACITY, seed=0):
+    # A KLL-style quantile sketch for each column of a matrix (e.g. each
+    # control). Every column has a stack of levels, and a value at level h
+    # stands for 2 ** h of the original values. When a level fills up it is
+    # sorted and every other value (starting at a random offset, so that the
+    # errors cancel out on average) is promoted to the level above. The
+    # sketch only ever holds O(k log(n / k)) values per column, can be fed
+    # one chunk at a time, and sketches of separate chunks can be merged.
+    return {
+        'k': k,
+        'levels': [[np.empty(0)] for _ in range(n_columns)],
+        'rng': np.random.default_rng(seed),
+    }
+
+
+def compact(levels, k, rng):
+    # Promote half of each over-full level to the level above, working
+    # upwards, as promoting can make the next level over-full too.
+    h = 0
+    while h < len(levels):
+        if len(levels[h]) > k:
+            values = np.sort(levels[h])
+
+            # With an odd number of values, one stays behind.
+            kept = values[-1:] if len(values) % 2 else values[:0]
+            promoted = values[rng.integers(2):len(values) - len(kept):2]
+
+            levels[h] = kept
+            if h + 1 == len(levels):
+                levels.append(np.empty(0))
+            levels[h + 1] = np.concatenate([levels[h + 1], promoted])
+
+        h += 1
+
+
+def update_sketch(sketch, values):
+    # Add a (rows x columns) chunk of values, ignoring NaNs.
+    values = np.asarray(values, dtype=float)
+
+    for c, levels in enumerate(sketch['levels']):
+        column = values[:, c]
+        levels[0] = np.concatenate([levels[0], column[~np.isnan(column)]])
+        compact(levels, sketch['k'], sketch['rng'])
+
+    return sketch
+
+
+def merge_sketches(sketch, *others):
+    # Merge sketches of the same columns (e.g. from other worker processes)
+    # into the first one, level by level.
+    for other in others:
+        for levels, other_levels in zip(sketch['levels'], other['levels']):
+            for h, values in enumerate(other_levels):
+                if h == len(levels):
+                    levels.append(np.empty(0))
+                levels[h] = np.concatenate([levels[h], values])
+
+            compact(levels, sketch['k'], sketch['rng'])
+
+    return sketch
+
+
+def sketch_counts(sketch):
+    # The (approximate) number of values added to each column.
+    return np.array([
+        sum(len(values) << h for h, values in enumerate(levels))
+        for levels in sketch['levels']
+    ])
+
+
+def sketch_quantiles(sketch, quantiles):
+    # Estimate the given quantiles (between 0 and 1) of every column, as a
+    # (quantiles x columns) array, with NaN for columns with no values.
+    quantiles = np.atleast_1d(np.asarray(quantiles, dtype=float))
+
+    result = np.full((len(quantiles), len(sketch['levels'])), np.nan)
+
+    for c, levels in enumerate(sketch['levels']):
+        values = np.concatenate(levels)
+        if not len(values):
+            continue
+
+        weights = np.concatenate([np.full(len(v), 2.0 ** h) for h, v in enumerate(levels)])
+
+        order = np.argsort(values, kind='stable')
+        ranks = np.cumsum(weights[order])
+
+        # The smallest value whose cumulative weight reaches each quantile.
+        i = np.searchsorted(ranks, quantiles * ranks[-1], side='left')
+        result[:, c] = values[order][np.minimum(i, len(values) - 1)]
+
+    return result
@@ -0,0 +1,92 @@
+import matplotlib
+
+# Render without a display, this has to happen before pyplot is imported.
+matplotlib.use('Agg')
+
+import sys
+import time
+import matplotlib.pyplot as plt
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+import analyse_fast_riders
+import analyse_finishes
+import analyse_my_times
+import analyse_times
+
+from figure_cache import fetch_figure, figure_key, store_figure
+from rider_data import load_rider_data
+
+# Each figure, with the function which draws it and the parameters it is
+# drawn with (which are also part of its cache key).
+FIGURES = {
+    'rider_times.png': (analyse_times.main, {'dpi': 300, 'density': None}),
+    'rider_100hour_times.png': (analyse_fast_riders.main, {'dpi': 300}),
+    'finish_times.png': (analyse_finishes.main, {'dpi': 300}),
+    'my_times.png': (analyse_my_times.main, {'dpi': 300}),
+}
+
+
+def render(name, output_dir):
+    # Render one figure in a worker process, returning how long it took.
+    start = time.perf_counter()
+
+    plot, params = FIGURES[name]
+    plot(output_path=Path(output_dir).joinpath(name), show=False, **params)
+    plt.close('all')
+
+    return time.perf_counter() - start
+
+
+def render_all(output_dir='.', max_workers=None, use_cache=True):
+    Path(output_dir).mkdir(parents=True, exist_ok=True)
+
+    wall_times = {}
+    keys = {}
+
+    # Copy any figures which haven't changed straight out of the cache.
+    for name, (_, params) in FIGURES.items():
+        if not use_cache:
+            break
+
+        start = time.perf_counter()
+        keys[name] = figure_key(name, params)
+
+        if fetch_figure(keys[name], Path(output_dir).joinpath(name)):
+            wall_times[name] = time.perf_counter() - start
+            print(f'{name}: {wall_times[name]:.2f} s (cached)')
+
+    to_render = [name for name in FIGURES if name not in wall_times]
+    if not to_render:
+        return wall_times
+
+    # Parse the CSV once up front, so that every worker loads the same
+    # memory-mapped cache rather than each re-reading the CSV.
+    load_rider_data()
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(render, name, output_dir): name for name in to_render}
+
+        for future in as_completed(futures):
+            name = futures[future]
+            wall_times[name] = future.result()
+            print(f'{name}: {wall_times[name]:.2f} s')
+
+            if use_cache:
+                store_figure(keys[name], Path(output_dir).joinpath(name))
+
+    return wall_times
+
+
+def main():
+    output_dir = sys.argv[1] if len(sys.argv) > 1 else '.'
+
+    start = time.perf_counter()
+    render_all(output_dir)
+    print(f'Total: {time.perf_counter() - start:.2f} s')
+
+
+
+if __name__ == '__main__':
+    main()
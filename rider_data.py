@@ -0,0 +1,369 @@
+import csv
+import glob
+import hashlib
+import itertools
+import json
+import re
+import shutil
+import numpy as np
+
+from datetime import datetime, timezone
+from pathlib import Path
+
+from instrument import instrumented, stage
+
+PATH_TO_ROUTES = Path(__file__).parent.joinpath('routes')
+PATH_TO_CACHE = Path(__file__).parent.joinpath('cache')
+
+# Bump this whenever the layout of the cached arrays changes.
+CACHE_VERSION = 1
+
+# Timestamps are fixed-width 'dd/mm/YYYY HH:MM' strings, so we can pull the
+# digits straight out of the string buffer rather than calling strptime on
+# every cell. These are the character positions of each field.
+TIME_FORMAT = '%d/%m/%Y %H:%M'
+DIGIT_POSITIONS = [0, 1, 3, 4, 6, 7, 8, 9, 11, 12, 14, 15]
+SEPARATORS = {2: '/', 5: '/', 10: ' ', 13: ':'}
+
+
+def parse_times(strings, time_format=TIME_FORMAT):
+    # Convert an array of timestamp strings into minutes since the Unix epoch
+    # (as float64). Anything which isn't a valid timestamp, e.g. 'NULL',
+    # becomes NaN.
+    if time_format != TIME_FORMAT:
+        return parse_times_with_format(strings, time_format)
+
+    strings = np.asarray(strings)
+    shape = strings.shape
+
+    # Only the first 16 characters are looked at below, so anything longer
+    # (e.g. with seconds) has to be ruled out first.
+    if strings.dtype.kind == 'U' and strings.dtype.itemsize <= 16 * 4:
+        too_long = np.zeros(strings.size, dtype=bool)
+    else:
+        too_long = np.char.str_len(strings.astype(str)).reshape(-1) > 16
+
+    strings = np.ascontiguousarray(strings, dtype='U16')
+
+    # View each 16 character string as 16 unicode code points.
+    chars = strings.reshape(-1).view(np.uint32).reshape(-1, 16).astype(np.int32)
+
+    digits = chars[:, DIGIT_POSITIONS] - ord('0')
+    valid = np.all((digits >= 0) & (digits <= 9), axis=1)
+    for i, sep in SEPARATORS.items():
+        valid &= chars[:, i] == ord(sep)
+
+    day = digits[:, 0] * 10 + digits[:, 1]
+    month = digits[:, 2] * 10 + digits[:, 3]
+    year = digits[:, 4] * 1000 + digits[:, 5] * 100 + digits[:, 6] * 10 + digits[:, 7]
+    hour = digits[:, 8] * 10 + digits[:, 9]
+    minute = digits[:, 10] * 10 + digits[:, 11]
+
+    valid &= ~too_long
+    valid &= (month >= 1) & (month <= 12) & (day >= 1) & (hour < 24) & (minute < 60)
+
+    # Replace any invalid fields with a harmless date, so that the datetime
+    # arithmetic below doesn't overflow.
+    year = np.where(valid, year, 1970)
+    month = np.where(valid, month, 1)
+    day = np.where(valid, day, 1)
+
+    months = ((year - 1970) * 12 + month - 1).astype('datetime64[M]')
+    days = months.astype('datetime64[D]') + (day - 1)
+
+    # Catch days that roll over into the next month, e.g. 31/02.
+    valid &= days.astype('datetime64[M]') == months
+
+    minutes = days.astype(np.int64) * 1440 + hour * 60 + minute
+    minutes = np.where(valid, minutes, np.nan)
+
+    return minutes.reshape(shape)
+
+
+def parse_times_with_format(strings, time_format):
+    # The slow path, for data in any other timestamp layout. Only each
+    # distinct string is parsed with strptime, and there are far fewer of
+    # those than cells, as riders arrive at the same minutes.
+    strings = np.asarray(strings, dtype=str)
+
+    unique, inverse = np.unique(strings, return_inverse=True)
+
+    minutes = np.full(len(unique), np.nan)
+    for i, string in enumerate(unique):
+        try:
+            minutes[i] = datetime.strptime(string, time_format).replace(tzinfo=timezone.utc).timestamp() // 60
+        except ValueError:
+            pass
+
+    return minutes[inverse].reshape(strings.shape)
+
+
+def time_characters(minutes, dtype=np.uint32):
+    # The inverse of parse_times: lay out each time in minutes since the Unix
+    # epoch as the 16 characters of a 'dd/mm/YYYY HH:MM' string, in a
+    # (times x 16) array of character codes. NaN becomes 'NULL', padded
+    # with zeros. Viewing the result as 'U16' (for uint32) or 'S16' (for
+    # uint8) gives the strings without formatting each one in Python.
+    minutes = np.asarray(minutes, dtype=float).reshape(-1)
+
+    valid = ~np.isnan(minutes)
+    whole = np.where(valid, minutes, 0).astype(np.int64)
+
+    days = (whole // 1440).astype('datetime64[D]')
+    months = days.astype('datetime64[M]')
+
+    year = days.astype('datetime64[Y]').astype(np.int64) + 1970
+    month = months.astype(np.int64) % 12 + 1
+    day = (days - months).astype(np.int64) + 1
+    hour = whole % 1440 // 60
+    minute = whole % 60
+
+    chars = np.zeros((len(minutes), 16), dtype=dtype)
+    fields = [(0, day, 2), (3, month, 2), (6, year, 4), (11, hour, 2), (14, minute, 2)]
+    for position, value, width in fields:
+        for i in range(width):
+            chars[:, position + i] = value // 10 ** (width - 1 - i) % 10 + ord('0')
+    for i, sep in SEPARATORS.items():
+        chars[:, i] = ord(sep)
+
+    chars[~valid] = 0
+    chars[~valid, :4] = [ord(c) for c in 'NULL']
+
+    return chars
+
+
+def format_times(minutes):
+    # Convert an array of minutes since the Unix epoch into timestamp strings.
+    minutes = np.asarray(minutes, dtype=float)
+
+    return time_characters(minutes).view('U16').reshape(minutes.shape)
+
+
+def format_time(minutes):
+    # The same, for a single time.
+    return str(format_times([minutes])[0])
+
+
+def load_route(path):
+    # Load a route definition (see routes/lel2022.json): the control
+    # distances, the cut-off, the start waves and where the rider data is.
+    # The controls are put in order of distance, the data path is relative
+    # to the route file, and the start waves are expanded into an array of
+    # start times in minutes since the Unix epoch.
+    path = Path(path)
+    with open(path) as f:
+        config = json.load(f)
+
+    distances = config['controls']
+    time_format = config.get('time_format', TIME_FORMAT)
+
+    waves = config['start_waves']
+    first, last = parse_times([waves['first'], waves['last']], time_format)
+
+    return {
+        'name': config['name'],
+        'data': path.parent.joinpath(config['data']).resolve() if config.get('data') else None,
+        'time_format': time_format,
+        'cut_off_hours': config['cut_off_hours'],
+        'start_location_column': config.get('start_location_column'),
+        'control_distances': distances,
+        'controls': sorted(distances, key=distances.get),
+        'start_waves': np.arange(first, last + 1, waves['interval_minutes']),
+    }
+
+
+# The 2022 route is the default everywhere.
+ROUTE = load_route(PATH_TO_ROUTES.joinpath('lel2022.json'))
+
+PATH_TO_DATA = ROUTE['data']
+CONTROL_DISTANCES = ROUTE['control_distances']
+CONTROLS = ROUTE['controls']
+CUT_OFF_HOURS = ROUTE['cut_off_hours']
+
+
+@instrumented('truncate_dnf')
+def remove_times_after_dnf(times):
+    # Remove any control times which occur after a rider has a NULL value.
+    # There are weird disconnected lines which looks like riders have missed/skipped
+    # controls, which makes any graphs look messy. Assume that if a rider has a
+    # NULL value, they have DNFed from that control onwwards, and remove any
+    # subsequent times.
+    has_dnfed = np.logical_or.accumulate(np.isnan(times), axis=1)
+
+    return np.where(has_dnfed, np.nan, times)
+
+
+@instrumented('impute')
+def impute_skipped_times(times, route=ROUTE):
+    # Fill in isolated missing times, i.e. a NULL at a control where the
+    # rider has times at the controls either side, by interpolating between
+    # those two times according to the distance along the route. Returns the
+    # filled matrix, and a mask of the cells which were imputed. Runs of more
+    # than one missing control, and the start and finish, are left alone.
+    distances = np.array([route['control_distances'][loc] for loc in route['controls']])
+
+    before, gap, after = times[:, :-2], times[:, 1:-1], times[:, 2:]
+    isolated = np.isnan(gap) & (after >= before)
+
+    fraction = (distances[1:-1] - distances[:-2]) / (distances[2:] - distances[:-2])
+    filled = np.round(before + (after - before) * fraction)
+
+    imputed = np.zeros(times.shape, dtype=bool)
+    imputed[:, 1:-1] = isolated
+
+    times = np.array(times)
+    times[:, 1:-1][isolated] = filled[isolated]
+
+    return times, imputed
+
+
+@instrumented('parse_times')
+def parse_table(table, header, route=ROUTE):
+    # Parse all of the control times in a table of CSV strings into a
+    # (riders x controls) matrix, with the columns in the same order as the
+    # route's controls and NaN wherever the rider has no time.
+    columns = [header.index(c) for c in route['controls']]
+    times = parse_times(table[:, columns], route['time_format'])
+
+    if route['start_location_column']:
+        start_locations = table[:, header.index(route['start_location_column'])]
+    else:
+        start_locations = np.full(len(table), '')
+
+    return times, start_locations
+
+
+def parse_rider_data(path=PATH_TO_DATA, route=ROUTE):
+    # Read the whole CSV as a table of strings in one go, and parse it.
+    with open(path, 'r') as f:
+        header = next(csv.reader(f))
+
+    with stage('read_csv') as record:
+        table = np.loadtxt(path, delimiter=',', dtype=str, skiprows=1, ndmin=2, encoding='utf-8')
+        record['rows'] = len(table)
+
+    return parse_table(table, header, route)
+
+
+def iter_rider_data(path=PATH_TO_DATA, chunk_size=100_000, route=ROUTE):
+    # Stream the CSV in chunks of at most chunk_size riders, yielding the
+    # parsed (times, start_locations) for each chunk, so that memory use is
+    # bounded by the chunk size rather than by the size of the file.
+    with open(path, 'r', encoding='utf-8') as f:
+        header = next(csv.reader([f.readline()]))
+
+        while True:
+            lines = list(itertools.islice(f, chunk_size))
+            if not lines:
+                break
+
+            table = np.loadtxt(lines, delimiter=',', dtype=str, ndmin=2)
+
+            yield parse_table(table, header, route)
+
+
+def cache_key(path, route=ROUTE):
+    # The cache is keyed on the contents of the CSV and on the route, so it
+    # is rebuilt if either of them changes.
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+
+    h.update(repr(sorted(route['control_distances'].items())).encode())
+    h.update(route['time_format'].encode())
+    h.update(str(CACHE_VERSION).encode())
+
+    return h.hexdigest()[:16]
+
+
+def stale_cache_dirs(cache_dir):
+    # Every cache (finished or temporary) built from the same file as
+    # cache_dir, i.e. '<stem>-<16 hex digit key>' and '<...>.tmp'. Matching
+    # the key exactly means 'lel2022-live-...' isn't taken for a cache of
+    # 'lel2022'.
+    stem = cache_dir.name.rsplit('-', 1)[0]
+    pattern = re.compile(re.escape(stem) + r'-[0-9a-f]{16}(\.tmp)?')
+
+    return [path for path in cache_dir.parent.glob(f'{glob.escape(stem)}-*') if pattern.fullmatch(path.name)]
+
+
+@instrumented('write_cache', rows=lambda result: None)
+def write_cache(cache_dir, times, location_codes, location_names, controls=CONTROLS):
+    # Write into a temporary directory first and then rename it, so that a
+    # half-written cache is never picked up by another run.
+    tmp_dir = cache_dir.with_name(cache_dir.name + '.tmp')
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    tmp_dir.mkdir(parents=True)
+
+    np.save(tmp_dir.joinpath('times.npy'), times)
+    np.save(tmp_dir.joinpath('start_location_codes.npy'), location_codes)
+    np.save(tmp_dir.joinpath('start_location_names.npy'), location_names)
+    np.save(tmp_dir.joinpath('controls.npy'), np.array(controls))
+
+    # Remove any stale caches built from older versions of this file.
+    for old_dir in stale_cache_dirs(cache_dir):
+        if old_dir != tmp_dir:
+            shutil.rmtree(old_dir, ignore_errors=True)
+
+    tmp_dir.rename(cache_dir)
+
+
+@instrumented('read_cache', rows=lambda result: None if result is None else len(result[0]))
+def read_cache(cache_dir, controls=CONTROLS):
+    # The time matrix is memory mapped copy-on-write, so loading it doesn't
+    # read the whole file up front, and callers can still clean it in place
+    # without touching the cache on disk.
+    if list(np.load(cache_dir.joinpath('controls.npy'))) != controls:
+        return None
+
+    times = np.load(cache_dir.joinpath('times.npy'), mmap_mode='c')
+    location_codes = np.load(cache_dir.joinpath('start_location_codes.npy'))
+    location_names = np.load(cache_dir.joinpath('start_location_names.npy'))
+
+    return times, location_codes, location_names
+
+
+@instrumented('load_rider_data')
+def load_rider_table(path=None, use_cache=True, truncate_dnf=False, route=ROUTE, impute=False):
+    # Load the (riders x controls) time matrix and the start locations, as
+    # integer codes into a sorted array of location names, from the binary
+    # cache if there is one for this CSV, otherwise by parsing the CSV (and
+    # then caching the result for next time). By default, this is the
+    # route's own data. Isolated missing times can be imputed first (see
+    # impute_skipped_times), so that they don't count as DNFs.
+    path = Path(path or route['data'])
+
+    cached = None
+
+    if use_cache:
+        cache_dir = PATH_TO_CACHE.joinpath(f'{path.stem}-{cache_key(path, route)}')
+
+        if cache_dir.exists():
+            cached = read_cache(cache_dir, route['controls'])
+
+    if cached is not None:
+        times, location_codes, location_names = cached
+    else:
+        times, start_locations = parse_rider_data(path, route)
+
+        location_names, location_codes = np.unique(start_locations, return_inverse=True)
+        location_codes = location_codes.astype(np.int32).reshape(-1)
+
+        if use_cache:
+            write_cache(cache_dir, times, location_codes, location_names, route['controls'])
+
+    if impute:
+        times, _ = impute_skipped_times(times, route)
+
+    if truncate_dnf:
+        times = remove_times_after_dnf(times)
+
+    return times, location_codes, location_names
+
+
+def load_rider_data(path=None, use_cache=True, truncate_dnf=False, route=ROUTE, impute=False):
+    # The same, with the start locations as strings.
+    times, location_codes, location_names = load_rider_table(path, use_cache, truncate_dnf, route, impute)
+
+    return times, location_names[location_codes]
@@ -0,0 +1,199 @@
+import argparse
+import sqlite3
+import numpy as np
+
+from contextlib import closing
+from pathlib import Path
+
+from instrument import instrumented, stage
+from rider_data import PATH_TO_CACHE, ROUTE, load_rider_data, parse_times
+
+PATH_TO_DATABASE = PATH_TO_CACHE.joinpath('riders.sqlite')
+
+# Times are stored as whole minutes since the Unix epoch, the same as in the
+# time matrix, so they can be compared and subtracted directly in SQL.
+SCHEMA = '''
+CREATE TABLE controls (
+    control_id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE,
+    distance_km REAL NOT NULL
+);
+
+CREATE TABLE riders (
+    rider_id INTEGER PRIMARY KEY,
+    start_location TEXT NOT NULL,
+    start_time INTEGER,
+    finish_time INTEGER,
+    finished INTEGER NOT NULL,
+    last_control_id INTEGER REFERENCES controls (control_id)
+);
+
+CREATE TABLE arrivals (
+    rider_id INTEGER NOT NULL REFERENCES riders (rider_id),
+    control_id INTEGER NOT NULL REFERENCES controls (control_id),
+    arrival_time INTEGER NOT NULL,
+    elapsed_minutes INTEGER,
+    PRIMARY KEY (rider_id, control_id)
+) WITHOUT ROWID;
+'''
+
+# Created after the bulk insert, which is much faster than keeping them up
+# to date row by row.
+INDEXES = '''
+CREATE INDEX arrivals_control_time ON arrivals (control_id, arrival_time);
+CREATE INDEX arrivals_control_elapsed ON arrivals (control_id, elapsed_minutes);
+CREATE INDEX riders_finished ON riders (finished, start_location);
+'''
+
+
+def nullable(values):
+    # numpy values -> a list of Python ints, with None for NaN, for sqlite3.
+    values = np.asarray(values)
+    missing = np.isnan(values)
+
+    ints = np.where(missing, 0, values).astype(np.int64).astype(object)
+    ints[missing] = None
+
+    return ints.tolist()
+
+
+@instrumented('export_sqlite', rows=lambda result: None)
+def export_sqlite(db_path=PATH_TO_DATABASE, path=None, route=ROUTE):
+    # Write the parsed rider data to a new SQLite database, replacing any
+    # existing one. Rider ids are the row numbers in the time matrix.
+    times, start_locations = load_rider_data(path, route=route)
+    times = np.asarray(times)
+
+    db_path = Path(db_path)
+    db_path.parent.mkdir(parents=True, exist_ok=True)
+    db_path.unlink(missing_ok=True)
+
+    n_riders, n_controls = times.shape
+
+    reached = ~np.isnan(times)
+    last_control = np.where(reached.any(axis=1), n_controls - 1 - np.argmax(reached[:, ::-1], axis=1), np.nan)
+
+    rider_ids, control_ids = np.nonzero(reached)
+    arrival_times = times[rider_ids, control_ids]
+    elapsed = arrival_times - times[rider_ids, 0]
+
+    # The connection's own context manager only commits, closing() closes it.
+    with closing(sqlite3.connect(db_path)) as db, db:
+        db.execute('PRAGMA journal_mode = OFF')
+        db.execute('PRAGMA synchronous = OFF')
+        db.execute('PRAGMA temp_store = MEMORY')
+        db.execute('PRAGMA cache_size = -262144')
+        db.executescript(SCHEMA)
+
+        db.executemany(
+            'INSERT INTO controls VALUES (?, ?, ?)',
+            [(c, name, route['control_distances'][name]) for c, name in enumerate(route['controls'])],
+        )
+
+        db.executemany(
+            'INSERT INTO riders VALUES (?, ?, ?, ?, ?, ?)',
+            zip(
+                range(n_riders),
+                start_locations.tolist(),
+                nullable(times[:, 0]),
+                nullable(times[:, -1]),
+                reached[:, -1].astype(int).tolist(),
+                nullable(last_control),
+            ),
+        )
+
+        with stage('insert_arrivals') as record:
+            db.executemany(
+                'INSERT INTO arrivals VALUES (?, ?, ?, ?)',
+                zip(rider_ids.tolist(), control_ids.tolist(), arrival_times.astype(np.int64).tolist(), nullable(elapsed)),
+            )
+            record['rows'] = len(rider_ids)
+
+        db.executescript(INDEXES)
+        db.execute('ANALYZE')
+
+    return db_path
+
+
+def rider_filter(finished=None, start_location=None, start_time=None, reached=None):
+    # Build the WHERE clause (and its parameters) which selects riders:
+    #   finished: True for finishers, False for everyone else
+    #   start_location: e.g. 'Debden'
+    #   start_time: the start wave, e.g. '07/08/2022 05:00', or in minutes
+    #     since the Unix epoch
+    #   reached: (control, hours), riders who reached the control within
+    #     that many hours of their start
+    clauses = []
+    params = []
+
+    if finished is not None:
+        clauses.append('r.finished = ?')
+        params.append(int(finished))
+
+    if start_location is not None:
+        clauses.append('r.start_location = ?')
+        params.append(start_location)
+
+    if start_time is not None:
+        clauses.append('r.start_time = ?')
+        if isinstance(start_time, str):
+            start_time = parse_times(start_time)
+        params.append(int(start_time))
+
+    if reached is not None:
+        control, hours = reached
+        clauses.append(
+            'r.rider_id IN ('
+            'SELECT a.rider_id FROM arrivals a JOIN controls c USING (control_id) '
+            'WHERE c.name = ? AND a.elapsed_minutes <= ?)'
+        )
+        params += [control, hours * 60]
+
+    return ' AND '.join(clauses) or '1', params
+
+
+@instrumented('query_sqlite')
+def query_rider_data(db_path=PATH_TO_DATABASE, **filters):
+    # Load the (riders x controls) time matrix and start locations of only
+    # the riders matching the filters (see rider_filter), in the same form
+    # as rider_data.load_rider_data. The filtering happens in SQLite, using
+    # the indexes, so only the matching riders' arrivals are read.
+    where, params = rider_filter(**filters)
+
+    with closing(sqlite3.connect(db_path)) as db:
+        n_controls = db.execute('SELECT COUNT(*) FROM controls').fetchone()[0]
+
+        riders = db.execute(
+            f'SELECT r.rider_id, r.start_location FROM riders r WHERE {where} ORDER BY r.rider_id',
+            params,
+        ).fetchall()
+
+        arrivals = db.execute(
+            f'SELECT a.rider_id, a.control_id, a.arrival_time FROM arrivals a '
+            f'JOIN riders r USING (rider_id) WHERE {where}',
+            params,
+        ).fetchall()
+
+    rider_ids = np.array([r[0] for r in riders], dtype=np.int64)
+    start_locations = np.array([r[1] for r in riders], dtype=str)
+
+    times = np.full((len(riders), n_controls), np.nan)
+    if arrivals:
+        arrivals = np.array(arrivals, dtype=np.int64)
+        times[np.searchsorted(rider_ids, arrivals[:, 0]), arrivals[:, 1]] = arrivals[:, 2]
+
+    return times, start_locations
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export the rider data to a SQLite database.')
+    parser.add_argument('--data', help='Path to the rider data CSV.')
+    parser.add_argument('--output', default=PATH_TO_DATABASE, help='Where to write the database.')
+    args = parser.parse_args()
+
+    print(f'Wrote {export_sqlite(args.output, args.data)}')
+
+
+
+if __name__ == '__main__':
+    main()
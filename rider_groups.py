@@ -0,0 +1,131 @@
+import numpy as np
+
+from instrument import instrumented
+from pace import elapsed_hours
+from rider_data import ROUTE, format_time, load_rider_table, parse_times
+
+
+@instrumented('group_riders')
+def group_riders(times, location_codes, location_names, route=ROUTE):
+    # Index the riders by start location and start wave. Each rider gets an
+    # integer wave code (its position in the route's start waves, or one
+    # past the last wave for riders without a start time or who started
+    # outside the waves), and the riders are put in order of (location,
+    # wave), keeping their original order within each group. After that,
+    # every group is a contiguous range of rows, so a group's times are a
+    # slice (a view, not a copy) of the reordered matrix.
+    waves = route['start_waves']
+    n_waves = len(waves) + 1
+
+    start_times = times[:, 0]
+    wave_codes = np.searchsorted(waves, start_times)
+    in_wave = wave_codes < len(waves)
+    in_wave[in_wave] = waves[wave_codes[in_wave]] == start_times[in_wave]
+    wave_codes = np.where(in_wave, wave_codes, len(waves))
+
+    keys = location_codes.astype(np.int64) * n_waves + wave_codes
+    order = np.argsort(keys, kind='stable')
+
+    n_groups = len(location_names) * n_waves
+    offsets = np.concatenate([[0], np.cumsum(np.bincount(keys, minlength=n_groups))])
+
+    return {
+        'times': times[order],
+        'order': order,
+        'keys': keys[order],
+        'offsets': offsets,
+        'location_names': location_names,
+        'waves': waves,
+        'time_format': route['time_format'],
+    }
+
+
+def load_rider_groups(path=None, use_cache=True, truncate_dnf=False, route=ROUTE):
+    # Load the rider data (see rider_data.load_rider_table) already grouped.
+    times, location_codes, location_names = load_rider_table(path, use_cache, truncate_dnf, route)
+
+    return group_riders(times, location_codes, location_names, route)
+
+
+def location_code(groups, location):
+    code = np.searchsorted(groups['location_names'], location)
+    if code == len(groups['location_names']) or groups['location_names'][code] != location:
+        raise KeyError(f'No riders started from {location!r}')
+
+    return code
+
+
+def wave_code(groups, wave):
+    # A start wave can be given as a time string or in minutes since the
+    # Unix epoch. None means riders outside the start waves.
+    if wave is None:
+        return len(groups['waves'])
+
+    if isinstance(wave, str):
+        wave = parse_times(wave, groups['time_format'])
+
+    code = np.searchsorted(groups['waves'], wave)
+    if code == len(groups['waves']) or groups['waves'][code] != wave:
+        raise KeyError(f'{format_time(wave)} is not a start wave')
+
+    return code
+
+
+def group_rows(groups, location, wave=None):
+    # The range of rows for a start location, and optionally a start wave.
+    n_waves = len(groups['waves']) + 1
+    first = location_code(groups, location) * n_waves
+
+    if wave is None:
+        return slice(groups['offsets'][first], groups['offsets'][first + n_waves])
+
+    key = first + wave_code(groups, wave)
+
+    return slice(groups['offsets'][key], groups['offsets'][key + 1])
+
+
+def group_times(groups, location, wave=None):
+    # The times of the riders in a group, as a view of the grouped matrix.
+    return groups['times'][group_rows(groups, location, wave)]
+
+
+@instrumented('group_stats', rows=lambda result: len(result[0]))
+def group_stats(groups, values):
+    # The number of non-NaN values and their mean for every group, from one
+    # value per rider (in grouped order), in a single pass over the values.
+    # Group g is location g // (waves + 1) and wave g % (waves + 1).
+    n_groups = len(groups['offsets']) - 1
+
+    has_value = ~np.isnan(values)
+    keys = groups['keys'][has_value]
+
+    counts = np.bincount(keys, minlength=n_groups)
+    sums = np.bincount(keys, weights=values[has_value], minlength=n_groups)
+
+    with np.errstate(invalid='ignore'):
+        means = sums / counts
+
+    return counts, means
+
+
+def main():
+    groups = load_rider_groups()
+
+    finish_times = elapsed_hours(groups['times'])[:, -1]
+    n_finished, mean_finish = group_stats(groups, finish_times)
+
+    n_riders = np.diff(groups['offsets'])
+    n_waves = len(groups['waves']) + 1
+
+    print(f'{"Start location":<16} {"Wave":<16} {"Riders":>7} {"Finishers":>10} {"Mean finish (h)":>16}')
+    for g in np.flatnonzero(n_riders):
+        location = groups['location_names'][g // n_waves] or '(none)'
+        wave = g % n_waves
+        wave = format_time(groups['waves'][wave]) if wave < len(groups['waves']) else '(other)'
+
+        print(f'{location:<16} {wave:<16} {n_riders[g]:>7} {n_finished[g]:>10} {mean_finish[g]:>16.2f}')
+
+
+
+if __name__ == '__main__':
+    main()
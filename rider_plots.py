@@ -0,0 +1,175 @@
+import numpy as np
+import matplotlib.pyplot as plt
+from matplotlib.collections import LineCollection
+from matplotlib.colors import LogNorm
+
+from instrument import instrumented
+
+
+@instrumented('plot_lines', rows=lambda result: None)
+def plot_rider_lines(distances, rider_times, colours, lw=1.5, markersize=12, markeredgewidth=1):
+    # Plot every rider's times as one LineCollection, plus a marker for the
+    # final control each rider reached as one scatter, rather than creating
+    # two Line2D artists per rider (which is very slow with 1000s of riders).
+    ax = plt.gca()
+
+    distances = np.asarray(distances)
+
+    segments = np.stack([np.broadcast_to(distances, rider_times.shape), rider_times], axis=-1)
+    lines = LineCollection(
+        segments,
+        colors=colours,
+        linewidths=lw,
+        capstyle='projecting',
+        joinstyle='round',
+        zorder=2,
+    )
+    ax.add_collection(lines)
+
+    # Find the last control each rider reached.
+    reached = ~np.isnan(rider_times)
+    last_control = rider_times.shape[1] - 1 - np.argmax(reached[:, ::-1], axis=1)
+
+    ax.scatter(
+        distances[last_control],
+        rider_times[np.arange(len(rider_times)), last_control],
+        s=markersize ** 2,
+        c=colours,
+        marker='X',
+        linewidths=markeredgewidth,
+        edgecolors='black',
+        zorder=2,
+    )
+
+    ax.autoscale_view()
+
+
+def rider_density(distances, rider_times, x_bins, y_bins, chunk_size=10_000):
+    # Accumulate every rider's line into a 2D grid of (distance x time)
+    # counts. Each line is sampled at the centre of every distance bin by
+    # linearly interpolating between the controls either side, so each rider
+    # adds at most one count per column. Riders are processed in chunks to
+    # keep memory bounded by chunk_size * len(x_bins).
+    distances = np.asarray(distances)
+    x_centres = (x_bins[:-1] + x_bins[1:]) / 2
+
+    # Which stage (pair of consecutive controls) each column falls in, and
+    # how far along that stage it is.
+    stage = np.clip(np.searchsorted(distances, x_centres) - 1, 0, len(distances) - 2)
+    t = (x_centres - distances[stage]) / (distances[stage + 1] - distances[stage])
+
+    grid = np.zeros((len(x_bins) - 1, len(y_bins) - 1))
+
+    for i in range(0, len(rider_times), chunk_size):
+        chunk = rider_times[i:i + chunk_size]
+
+        # NaN at either end of a stage gives NaN, which histogram2d ignores.
+        y = chunk[:, stage] + (chunk[:, stage + 1] - chunk[:, stage]) * t
+        x = np.broadcast_to(x_centres, y.shape)
+
+        has_time = ~np.isnan(y)
+        grid += np.histogram2d(x[has_time], y[has_time], bins=[x_bins, y_bins])[0]
+
+    return grid
+
+
+@instrumented('plot_density', rows=lambda result: None)
+def plot_rider_density(distances, rider_times, n_x=400, n_y=300, cmap='magma_r', marker_cmap='winter_r'):
+    # Draw all of the riders as a density image rather than one line each,
+    # so the time taken depends on the size of the grid rather than the
+    # number of riders. The final control each rider reached is drawn as a
+    # second density layer on top.
+    ax = plt.gca()
+
+    distances = np.asarray(distances)
+
+    y_min, y_max = np.nanmin(rider_times), np.nanmax(rider_times)
+    x_bins = np.linspace(distances[0], distances[-1], n_x + 1)
+    y_bins = np.linspace(y_min, y_max, n_y + 1)
+    extent = [x_bins[0], x_bins[-1], y_bins[0], y_bins[-1]]
+
+    grid = rider_density(distances, rider_times, x_bins, y_bins)
+
+    image = ax.imshow(
+        np.ma.masked_equal(grid.T, 0),
+        origin='lower',
+        extent=extent,
+        aspect='auto',
+        cmap=cmap,
+        norm=LogNorm(),
+        interpolation='nearest',
+        zorder=2,
+    )
+
+    # Density of the final control each rider reached. These are only ever
+    # at a control, so count them per (control, time bin) and draw each
+    # non-empty cell as one point of a single scatter, coloured by count.
+    reached = ~np.isnan(rider_times)
+    last_control = rider_times.shape[1] - 1 - np.argmax(reached[:, ::-1], axis=1)
+    last_times = rider_times[np.arange(len(rider_times)), last_control]
+
+    marker_y_bins = np.linspace(y_min, y_max, n_y // 10 + 1)
+    marker_grid = np.histogram2d(
+        last_control,
+        last_times,
+        bins=[np.arange(len(distances) + 1) - 0.5, marker_y_bins],
+    )[0]
+
+    control_index, y_index = np.nonzero(marker_grid)
+
+    ax.scatter(
+        distances[control_index],
+        (marker_y_bins[y_index] + marker_y_bins[y_index + 1]) / 2,
+        s=60,
+        c=marker_grid[control_index, y_index],
+        cmap=marker_cmap,
+        norm=LogNorm(),
+        marker='X',
+        linewidths=0.5,
+        edgecolors='black',
+        zorder=3,
+    )
+
+    plt.colorbar(image, ax=ax, label='Number of riders')
+
+
+@instrumented('plot_bands', rows=lambda result: None)
+def plot_pace_bands(distances, quantiles, band_quantiles, cmap='winter'):
+    # Draw percentile bands of the riders' times at each control, from a
+    # (quantiles x controls) array (see quantile_sketch.sketch_quantiles).
+    # The quantiles are paired off from the outside in, so e.g. 10/90 and
+    # 25/75 become two nested bands, and a middle quantile (the median) is
+    # drawn as a line.
+    ax = plt.gca()
+
+    distances = np.asarray(distances)
+    band_quantiles = list(band_quantiles)
+    n_bands = len(band_quantiles) // 2
+
+    colours = plt.get_cmap(cmap)(np.linspace(0.2, 0.8, max(n_bands, 1)))
+
+    for i in range(n_bands):
+        low, high = band_quantiles[i], band_quantiles[-1 - i]
+        ax.fill_between(
+            distances,
+            quantiles[i],
+            quantiles[-1 - i],
+            color=colours[i],
+            alpha=0.6,
+            lw=0,
+            label=f'{low * 100:g}th - {high * 100:g}th percentile',
+            zorder=2,
+        )
+
+    if len(band_quantiles) % 2:
+        ax.plot(
+            distances,
+            quantiles[n_bands],
+            color='black',
+            lw=2.5,
+            marker='o',
+            label=f'{band_quantiles[n_bands] * 100:g}th percentile',
+            zorder=3,
+        )
+
+    ax.legend(loc='lower left', fontsize=14)
@@ -0,0 +1,144 @@
+import csv
+import sys
+import numpy as np
+
+from instrument import instrumented
+from rider_data import ROUTE, load_rider_data
+from rider_validation import previous_recorded
+
+# A stage has to take at least this much longer than expected, both at the
+# rider's own pace and at the field's, to count as a stop. That's longer
+# than any food stop, so in practice these are the sleeps.
+MIN_STOP_HOURS = 3.0
+
+
+def place_name(control):
+    # 'BarnardCastle Northbound' -> 'Barnard Castle', for labels.
+    name = control.replace('Northbound', '').replace('Southbound', '').replace('Finish', '').replace(' ', '')
+
+    return ''.join(f' {ch}' if ch.isupper() and i else ch for i, ch in enumerate(name))
+
+
+def stage_times(rider_data, route=ROUTE):
+    # The hours and kilometres of every stage, as (riders x controls) arrays
+    # where column c is the stage which ends at control c. A stage starts at
+    # the rider's last recorded control, so a skipped control makes one long
+    # stage rather than two missing ones. Cells with no stage are NaN, as
+    # are stages with a non-positive time, which are bad data.
+    distances = np.array([route['control_distances'][loc] for loc in route['controls']])
+
+    previous = previous_recorded(rider_data)
+    from_control = np.maximum(previous, 0)
+
+    rows = np.arange(len(rider_data))[:, None]
+    hours = (rider_data - rider_data[rows, from_control]) / 60
+    kilometres = (distances - distances[from_control]) * np.ones((len(rider_data), 1))
+
+    has_stage = (previous >= 0) & (hours > 0)
+    hours = np.where(has_stage, hours, np.nan)
+    kilometres = np.where(has_stage, kilometres, np.nan)
+
+    return hours, kilometres, previous
+
+
+def field_speeds(rider_data, route=ROUTE):
+    # The median speed (km/h, stops included) of the whole field over each
+    # stage, NaN for the start.
+    hours, kilometres, _ = stage_times(rider_data, route)
+
+    with np.errstate(all='ignore'):
+        speeds = kilometres / hours
+
+    speeds[:, 0] = np.nan
+    counts = np.sum(~np.isnan(speeds), axis=0)
+
+    return np.where(counts > 0, np.nanmedian(np.where(counts > 0, speeds, 0.0), axis=0), np.nan)
+
+
+@instrumented('find_stops')
+def find_stops(rider_data, speeds=None, min_stop_hours=MIN_STOP_HOURS, route=ROUTE):
+    # Find every rider's long stops in one pass over the (riders x controls)
+    # time matrix. Each stage's time is compared with the time it would have
+    # taken over the same distance at:
+    #   - the rider's own typical pace (their median stage speed), and
+    #   - the field's median pace over that stage (from speeds, see
+    #     field_speeds, which defaults to this data's own field)
+    # A stage which is at least min_stop_hours slower than both is a stop,
+    # and the smaller of the two excesses is how long it was. Stops are
+    # reported at the control the stage started from, which is where the
+    # rider stopped. Returns the stop hours as a (riders x controls) array,
+    # NaN where there was no stop.
+    if speeds is None:
+        speeds = field_speeds(rider_data, route)
+
+    hours, kilometres, previous = stage_times(rider_data, route)
+
+    with np.errstate(all='ignore'):
+        stage_speeds = kilometres / hours
+        has_speed = np.any(~np.isnan(stage_speeds), axis=1)
+        rider_speeds = np.full(len(rider_data), np.nan)
+        rider_speeds[has_speed] = np.nanmedian(stage_speeds[has_speed], axis=1)
+
+        over_rider = hours - kilometres / rider_speeds[:, None]
+        over_field = hours - kilometres / speeds
+
+    excess = np.fmin(over_rider, over_field)
+    stopped = excess >= min_stop_hours
+
+    # Move each stop back to the control the stage started from.
+    stops = np.full(rider_data.shape, np.nan)
+    riders, controls = np.nonzero(stopped)
+    stops[riders, previous[riders, controls]] = excess[riders, controls]
+
+    return stops
+
+
+def stop_table(stops, route=ROUTE):
+    # The field-wide summary: for each control, how many riders stopped
+    # there and for how long.
+    stopped = ~np.isnan(stops)
+    counts = np.sum(stopped, axis=0)
+
+    with np.errstate(all='ignore'):
+        median_hours = np.nanmedian(np.where(counts > 0, stops, 0.0), axis=0)
+
+    return [
+        {
+            'control': control,
+            'riders': int(counts[c]),
+            'median_hours': round(float(median_hours[c]), 2) if counts[c] else '',
+        }
+        for c, control in enumerate(route['controls'])
+    ]
+
+
+def write_table(f, table):
+    writer = csv.DictWriter(f, fieldnames=['control', 'riders', 'median_hours'])
+    writer.writeheader()
+    writer.writerows(table)
+
+
+def main():
+    rider_data, _ = load_rider_data()
+
+    stops = find_stops(rider_data)
+    stopped = ~np.isnan(stops)
+
+    print(f'Riders with a stop of {MIN_STOP_HOURS} hours or more: {np.sum(stopped.any(axis=1))} of {len(rider_data)}')
+    print(f'Stops per rider who stopped: {np.sum(stopped) / max(np.sum(stopped.any(axis=1)), 1):.2f}')
+
+    table = stop_table(stops)
+
+    # The table, as CSV, goes to a file if one is given.
+    if len(sys.argv) > 1:
+        with open(sys.argv[1], 'w', newline='') as f:
+            write_table(f, table)
+        print(f'Wrote {sys.argv[1]}')
+    else:
+        print()
+        write_table(sys.stdout, table)
+
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,188 @@
+import shutil
+import numpy as np
+
+from pathlib import Path
+
+from instrument import instrumented
+from rider_data import PATH_TO_CACHE, ROUTE, cache_key, format_time, iter_rider_data, stale_cache_dirs
+
+PATH_TO_STORES = PATH_TO_CACHE.joinpath('stores')
+
+# Stands for a NULL time in the int32 minutes. Real offsets from the event
+# epoch are never anywhere near it.
+NULL_MINUTES = np.iinfo(np.int32).min
+
+
+# A compact copy of the rider data: each time is an int32 number of minutes
+# since the event's epoch (midnight on the day of the first start wave),
+# rather than a float64 number of minutes since 1970, and the start location
+# and wave are small integer codes. This is 4 bytes per cell, so 10 million
+# riders over 21 controls is about 840 MB, and a single rider at a time can
+# be looked at through a RiderRecord without building any dicts or strings.
+
+def event_epoch(route=ROUTE):
+    return route['start_waves'][0] // 1440 * 1440
+
+
+def category_dtype(n_categories):
+    return np.min_scalar_type(max(n_categories - 1, 0))
+
+
+def compact_times(times, epoch):
+    # float64 minutes since 1970 (NaN for NULL) -> int32 minutes since the
+    # epoch (NULL_MINUTES for NULL).
+    return np.where(np.isnan(times), NULL_MINUTES, times - epoch).astype(np.int32)
+
+
+def expand_times(minutes, epoch):
+    # The inverse, for any slice of a store's minutes.
+    return np.where(minutes == NULL_MINUTES, np.nan, minutes + float(epoch))
+
+
+def wave_codes(start_minutes, epoch, route=ROUTE):
+    # The position of each start time in the route's start waves, or one
+    # past the last wave for riders outside them.
+    waves = route['start_waves'] - epoch
+
+    codes = np.minimum(np.searchsorted(waves, start_minutes), len(waves) - 1)
+    codes = np.where(waves[codes] == start_minutes, codes, len(waves))
+
+    return codes.astype(category_dtype(len(waves) + 1))
+
+
+@instrumented('build_store')
+def build_store(path=None, chunk_size=100_000, route=ROUTE):
+    # Build a store by streaming the CSV, so that the float64 matrix for the
+    # whole file never has to exist. The start location names aren't known
+    # up front, so each chunk's locations are mapped into a growing list.
+    epoch = event_epoch(route)
+
+    minutes = []
+    location_codes = []
+    location_names = []
+
+    for times, start_locations in iter_rider_data(path or route['data'], chunk_size=chunk_size, route=route):
+        minutes.append(compact_times(times, epoch))
+
+        names, codes = np.unique(start_locations, return_inverse=True)
+        for name in names:
+            if name not in location_names:
+                location_names.append(name)
+        mapping = np.array([location_names.index(name) for name in names], dtype=np.int64)
+        location_codes.append(mapping[codes.reshape(-1)])
+
+    n_controls = len(route['controls'])
+    minutes = np.concatenate(minutes) if minutes else np.empty((0, n_controls), dtype=np.int32)
+    location_codes = np.concatenate(location_codes) if location_codes else np.empty(0, dtype=np.int64)
+
+    return {
+        'epoch': epoch,
+        'controls': np.array(route['controls']),
+        'minutes': minutes,
+        'location_codes': location_codes.astype(category_dtype(len(location_names))),
+        'location_names': np.array(location_names, dtype=str),
+        'wave_codes': wave_codes(minutes[:, 0], epoch, route),
+        'waves': route['start_waves'],
+    }
+
+
+STORE_ARRAYS = ['minutes', 'location_codes', 'location_names', 'wave_codes', 'waves', 'controls']
+
+
+def write_store(store_dir, store):
+    tmp_dir = store_dir.with_name(store_dir.name + '.tmp')
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    tmp_dir.mkdir(parents=True)
+
+    for name in STORE_ARRAYS:
+        np.save(tmp_dir.joinpath(f'{name}.npy'), store[name])
+    np.save(tmp_dir.joinpath('epoch.npy'), np.array(store['epoch']))
+
+    # Remove any stale stores built from older versions of the same file.
+    for old_dir in stale_cache_dirs(store_dir):
+        if old_dir != tmp_dir:
+            shutil.rmtree(old_dir, ignore_errors=True)
+
+    tmp_dir.rename(store_dir)
+
+
+def read_store(store_dir):
+    # The minutes are memory mapped read-only: a store is never modified.
+    store = {name: np.load(store_dir.joinpath(f'{name}.npy')) for name in STORE_ARRAYS if name != 'minutes'}
+    store['minutes'] = np.load(store_dir.joinpath('minutes.npy'), mmap_mode='r')
+    store['epoch'] = float(np.load(store_dir.joinpath('epoch.npy')))
+
+    return store
+
+
+def load_rider_store(path=None, use_cache=True, chunk_size=100_000, route=ROUTE):
+    # Load the store for a CSV from the cache, building it if needed.
+    path = Path(path or route['data'])
+
+    if not use_cache:
+        return build_store(path, chunk_size, route)
+
+    store_dir = PATH_TO_STORES.joinpath(f'{path.stem}-{cache_key(path, route)}')
+
+    if not store_dir.exists():
+        write_store(store_dir, build_store(path, chunk_size, route))
+
+    return read_store(store_dir)
+
+
+def store_times(store, rows=slice(None)):
+    # The float64 time matrix for some of the riders, e.g. one chunk at a
+    # time, in the same layout as rider_data.load_rider_data.
+    return expand_times(store['minutes'][rows], store['epoch'])
+
+
+class RiderRecord:
+    # One rider in a store. It only holds the store and a row number, and
+    # reads the row on demand, so creating one is cheap.
+    __slots__ = ('store', 'index')
+
+    def __init__(self, store, index):
+        self.store = store
+        self.index = index
+
+    def __getitem__(self, control):
+        # The time at a control, as a 'dd/mm/YYYY HH:MM' string, or None.
+        c = np.flatnonzero(self.store['controls'] == control)
+        if not len(c):
+            raise KeyError(control)
+
+        minutes = self.store['minutes'][self.index, c[0]]
+
+        return None if minutes == NULL_MINUTES else format_time(minutes + self.store['epoch'])
+
+    @property
+    def times(self):
+        # Minutes since the Unix epoch at each control, NaN for NULL.
+        return expand_times(self.store['minutes'][self.index], self.store['epoch'])
+
+    @property
+    def start_location(self):
+        return str(self.store['location_names'][self.store['location_codes'][self.index]])
+
+    @property
+    def start_wave(self):
+        code = self.store['wave_codes'][self.index]
+
+        return self.store['waves'][code] if code < len(self.store['waves']) else None
+
+    @property
+    def finish_hours(self):
+        minutes = self.store['minutes'][self.index, [0, -1]]
+        if np.any(minutes == NULL_MINUTES):
+            return None
+
+        return round((minutes[1] - minutes[0]) / 60, 2)
+
+    def __repr__(self):
+        return f'RiderRecord({self.index}, start_location={self.start_location!r}, finish_hours={self.finish_hours})'
+
+
+def riders(store):
+    # Iterate over the riders in a store one record at a time.
+    for i in range(len(store['minutes'])):
+        yield RiderRecord(store, i)
@@ -0,0 +1,121 @@
+import csv
+import sys
+import numpy as np
+
+from instrument import instrumented
+from rider_data import CONTROL_DISTANCES, CONTROLS, load_rider_data
+
+# No one averages more than this between two controls, stops included.
+MAX_STAGE_SPEED = 40.0
+
+ANOMALIES = ['skipped', 'non_monotonic', 'too_fast', 'no_start', 'finish_no_start']
+
+
+def previous_recorded(rider_data):
+    # For every cell, the column of the rider's last recorded time before
+    # it (-1 if there isn't one), by carrying the column numbers of the
+    # recorded cells forwards with a running maximum.
+    n_controls = rider_data.shape[1]
+
+    recorded_columns = np.where(np.isnan(rider_data), -1, np.arange(n_controls))
+    previous = np.maximum.accumulate(recorded_columns, axis=1)
+
+    return np.column_stack([np.full(len(rider_data), -1), previous[:, :-1]])
+
+
+@instrumented('validate')
+def find_anomalies(rider_data, max_speed=MAX_STAGE_SPEED):
+    # Flag suspicious cells in the (riders x controls) time matrix, as a
+    # boolean (riders x controls) mask for each kind of anomaly:
+    #   skipped: no time, but the rider has a time at a later control
+    #   non_monotonic: earlier than the rider's previous recorded time
+    #   too_fast: reached from the previous recorded control faster than
+    #     max_speed (km/h) on average
+    #   no_start: the start has no time but later controls do
+    #   finish_no_start: the finish has a time but the start doesn't
+    # Gaps are measured back to the last recorded control, so one skipped
+    # control doesn't hide a problem with the next one.
+    distances = np.array([CONTROL_DISTANCES[loc] for loc in CONTROLS])
+    recorded = ~np.isnan(rider_data)
+
+    # Whether there's a recorded time at any later control.
+    later_recorded = np.logical_or.accumulate(recorded[:, ::-1], axis=1)[:, ::-1]
+    later_recorded = np.column_stack([later_recorded[:, 1:], np.zeros(len(rider_data), dtype=bool)])
+
+    previous = previous_recorded(rider_data)
+    has_previous = recorded & (previous >= 0)
+
+    rows = np.arange(len(rider_data))[:, None]
+    previous_times = rider_data[rows, np.maximum(previous, 0)]
+
+    minutes = np.where(has_previous, rider_data - previous_times, np.nan)
+    kilometres = distances - distances[np.maximum(previous, 0)]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        too_fast = has_previous & (minutes >= 0) & (kilometres * 60 > max_speed * minutes)
+
+    skipped = ~recorded & later_recorded
+    skipped[:, 0] = False
+
+    no_start = np.zeros(rider_data.shape, dtype=bool)
+    no_start[:, 0] = ~recorded[:, 0] & later_recorded[:, 0]
+
+    finish_no_start = np.zeros(rider_data.shape, dtype=bool)
+    finish_no_start[:, -1] = recorded[:, -1] & ~recorded[:, 0]
+
+    return {
+        'skipped': skipped,
+        'non_monotonic': has_previous & (minutes < 0),
+        'too_fast': too_fast,
+        'no_start': no_start,
+        'finish_no_start': finish_no_start,
+    }
+
+
+def anomaly_report(anomalies):
+    # One row per rider with at least one anomaly: the number of cells of
+    # each kind, and the first control with a problem.
+    any_anomaly = np.zeros(anomalies['skipped'].shape, dtype=bool)
+    for mask in anomalies.values():
+        any_anomaly |= mask
+
+    riders = np.flatnonzero(any_anomaly.any(axis=1))
+    first_control = np.argmax(any_anomaly[riders], axis=1)
+
+    counts = {name: anomalies[name][riders].sum(axis=1) for name in ANOMALIES}
+
+    return [
+        {'rider': int(r), **{name: int(counts[name][i]) for name in ANOMALIES}, 'first_control': CONTROLS[first_control[i]]}
+        for i, r in enumerate(riders)
+    ]
+
+
+def write_report(f, report):
+    writer = csv.DictWriter(f, fieldnames=['rider'] + ANOMALIES + ['first_control'])
+    writer.writeheader()
+    writer.writerows(report)
+
+
+def main():
+    rider_data, _ = load_rider_data()
+
+    anomalies = find_anomalies(rider_data)
+    report = anomaly_report(anomalies)
+
+    print(f'Riders with anomalies: {len(report)} of {len(rider_data)}')
+    for name in ANOMALIES:
+        print(f'  {name:<14} {np.sum(anomalies[name].any(axis=1)):>6} riders {np.sum(anomalies[name]):>7} cells')
+
+    # The per-rider report, as CSV, goes to a file if one is given.
+    if len(sys.argv) > 1:
+        with open(sys.argv[1], 'w', newline='') as f:
+            write_report(f, report)
+        print(f'Wrote {sys.argv[1]}')
+    else:
+        print()
+        write_report(sys.stdout, report)
+
+
+
+if __name__ == '__main__':
+    main()